@@ -4,6 +4,7 @@ from flask_migrate import Migrate
 from flask_login import LoginManager
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+from flask_caching import Cache
 
 db = SQLAlchemy()
 migrate = Migrate()
@@ -14,9 +15,11 @@ login.login_message = None  # Disable automatic "Please log in" message
 limiter = Limiter(
     key_func=get_remote_address,
     default_limits=["200 per day", "50 per hour"],
-    storage_uri="memory://",
 )
 
+# Off (NullCache) unless CACHE_TYPE is configured; see config.py
+cache = Cache()
+
 main_bp = Blueprint("main", __name__)
 admin_bp = Blueprint(
     "admin",
@@ -47,20 +50,40 @@ def create_app(config_class=None):
         except OSError:
             pass
 
+    # Size the compiled statement cache for the app's set of ORM queries
+    engine_options = dict(app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}))
+    engine_options.setdefault("query_cache_size", 1200)
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options
+
     db.init_app(app)
     migrate.init_app(app, db)
     login.init_app(app)
     limiter.init_app(app)
+    cache.init_app(app)
+
+    # In-memory counters are per process, so each Gunicorn worker would allow
+    # the full limit on its own
+    if (
+        app.config.get("RATELIMIT_STORAGE_URI", "memory://").startswith("memory://")
+        and app.config.get("RATELIMIT_ENABLED", True)
+        and not (app.debug or app.testing)
+    ):
+        app.logger.warning(
+            "RATELIMIT_STORAGE_URI is memory://: every worker process keeps its "
+            "own rate limit counters. Set it to a Redis URI in production."
+        )
 
     # Import and register blueprints
     from app import routes, models  # noqa: F401, E402
 
     @app.context_processor
     def inject_theme():
-        from flask import request
+        from flask import g, request
 
-        theme = request.cookies.get("theme", "light")
-        return dict(theme=theme)
+        # Context processors run for every render_template call in a request
+        if "theme" not in g:
+            g.theme = request.cookies.get("theme", "light")
+        return dict(theme=g.theme)
 
     app.register_blueprint(main_bp)
 
@@ -68,4 +91,9 @@ def create_app(config_class=None):
 
     app.register_blueprint(admin_bp)
 
+    from app.tasks import cleanup_images_command, rerender_markdown_command
+
+    app.cli.add_command(cleanup_images_command)
+    app.cli.add_command(rerender_markdown_command)
+
     return app
@@ -16,10 +16,37 @@ from app.forms import (
     TagForm,
     PostForm,
 )
-from app.models import User, Tag, Post, Comment
+from app.models import User, Tag, Post, Comment, post_tags
 from app import db
-from app.utils import save_uploaded_file, cleanup_unused_images, safe_db_commit
-import os
+from app.debug import strict_loading
+from app.tasks import queue_image_cleanup
+from app.utils import (
+    save_uploaded_file,
+    list_uploaded_images,
+    safe_db_commit,
+)
+from sqlalchemy import func, select
+from sqlalchemy.orm import joinedload, selectinload
+
+
+def _is_htmx_request():
+    return request.headers.get("HX-Request") == "true"
+
+
+def _deleted_response(committed, endpoint):
+    """
+    Finish a delete from one of the admin list pages.
+
+    htmx requests get an empty body, which swaps the deleted card out of the
+    list in place instead of redirecting and re-rendering the whole page. If
+    the commit failed, htmx is told to reload the page so the flashed error
+    is shown.
+    """
+    if _is_htmx_request():
+        if committed:
+            return ""
+        return "", 200, {"HX-Refresh": "true"}
+    return redirect(url_for(endpoint))
 
 
 @admin_bp.before_request
@@ -62,7 +89,7 @@ def admin_register_user():
 
 @admin_bp.route("/admin/users")
 def admin_users():
-    users = User.query.all()
+    users = User.query.options(selectinload(User.allowed_tags), *strict_loading(User)).all()
     return render_template("admin/users.html", title="Manage Users", users=users)
 
 
@@ -81,7 +108,7 @@ def admin_edit_user(user_id):
     elif request.method == "GET":
         form.username.data = user.username
         form.email.data = user.email
-        form.allowed_tags.data = user.allowed_tags.all()
+        form.allowed_tags.data = list(user.allowed_tags)
     return render_template(
         "admin/edit_user.html", title="Edit User", form=form, user=user
     )
@@ -105,7 +132,15 @@ def admin_change_user_password(user_id):
 
 @admin_bp.route("/admin/tags")
 def admin_tags():
-    tags = Tag.query.all()
+    post_count = (
+        select(func.count())
+        .select_from(post_tags)
+        .where(post_tags.c.tag_id == Tag.id)
+        .correlate(Tag)
+        .scalar_subquery()
+        .label("post_count")
+    )
+    tags = db.session.query(Tag, post_count).all()
     return render_template("admin/tags.html", title="Manage Tags", tags=tags)
 
 
@@ -156,13 +191,30 @@ def admin_edit_tag(tag_id):
 def admin_delete_tag(tag_id):
     tag = Tag.query.get_or_404(tag_id)
     db.session.delete(tag)
-    safe_db_commit(db.session, "Tag has been deleted successfully!")
-    return redirect(url_for("admin.admin_tags"))
+    # The card disappearing is the confirmation for htmx requests
+    success_message = (
+        None if _is_htmx_request() else "Tag has been deleted successfully!"
+    )
+    committed = safe_db_commit(db.session, success_message)
+    return _deleted_response(committed, "admin.admin_tags")
 
 
 @admin_bp.route("/admin/posts")
 def admin_posts():
-    posts = Post.query.order_by(Post.timestamp.desc()).all()
+    # Count comments in the same statement instead of one COUNT per row
+    comment_count = (
+        select(func.count(Comment.id))
+        .where(Comment.post_id == Post.id)
+        .correlate(Post)
+        .scalar_subquery()
+        .label("comment_count")
+    )
+    posts = (
+        db.session.query(Post, comment_count)
+        .options(joinedload(Post.author), selectinload(Post.tags), *strict_loading(Post))
+        .order_by(Post.timestamp.desc())
+        .all()
+    )
     return render_template("admin/posts.html", title="Manage Posts", posts=posts)
 
 
@@ -184,12 +236,10 @@ def admin_create_post():
         )
         if safe_db_commit(db.session, success_msg):
             return redirect(url_for("admin.admin_posts"))
-    all_tags = Tag.query.all()
     return render_template(
         "admin/create_edit_post.html",
         title="Create New Post",
         form=form,
-        all_tags=all_tags,
     )
 
 
@@ -215,16 +265,14 @@ def admin_edit_post(post_id):
     elif request.method == "GET":
         form.title.data = post.title
         form.body.data = post.body
-        form.tags.data = post.tags.all()
+        form.tags.data = list(post.tags)
 
         form.comments_enabled.data = post.comments_enabled
-    all_tags = Tag.query.all()
     return render_template(
         "admin/create_edit_post.html",
         title="Edit Post",
         form=form,
         post=post,
-        all_tags=all_tags,
     )
 
 
@@ -232,8 +280,12 @@ def admin_edit_post(post_id):
 def admin_delete_post(post_id):
     post = Post.query.get_or_404(post_id)
     db.session.delete(post)
-    safe_db_commit(db.session, "Post has been deleted successfully!")
-    return redirect(url_for("admin.admin_posts"))
+    # The card disappearing is the confirmation for htmx requests
+    success_message = (
+        None if _is_htmx_request() else "Post has been deleted successfully!"
+    )
+    committed = safe_db_commit(db.session, success_message)
+    return _deleted_response(committed, "admin.admin_posts")
 
 
 @admin_bp.route("/admin/upload", methods=["POST"])
@@ -265,15 +317,7 @@ def admin_images():
     upload_folder = current_app.config["UPLOAD_FOLDER"]
 
     # Get all image files from the upload folder
-    if os.path.exists(upload_folder):
-        images = [
-            f
-            for f in os.listdir(upload_folder)
-            if os.path.isfile(os.path.join(upload_folder, f))
-            and f.lower().endswith((".png", ".jpg", ".jpeg", ".gif", ".webp"))
-        ]
-    else:
-        images = []
+    images = list_uploaded_images(upload_folder)
 
     # Create URLs for each image
     image_data = [
@@ -294,21 +338,23 @@ def admin_delete_user(user_id):
     # Prevent deleting yourself
     if user.id == current_user.id:
         flash("You cannot delete your own account!", "error")
-        return redirect(url_for("admin.admin_users"))
+        return _deleted_response(False, "admin.admin_users")
 
     db.session.delete(user)
-    safe_db_commit(db.session, "User has been deleted successfully!")
-    return redirect(url_for("admin.admin_users"))
+    # The card disappearing is the confirmation for htmx requests
+    success_message = (
+        None if _is_htmx_request() else "User has been deleted successfully!"
+    )
+    committed = safe_db_commit(db.session, success_message)
+    return _deleted_response(committed, "admin.admin_users")
 
 
 @admin_bp.route("/admin/images/cleanup", methods=["POST"])
 def admin_cleanup_images():
-    """Clean up unused images."""
-    deleted_count, deleted_files = cleanup_unused_images()
-
-    if deleted_count > 0:
-        flash(f"Successfully deleted {deleted_count} unused image(s).", "success")
-    else:
-        flash("No unused images found.", "success")
-
+    """Clean up unused images in the background."""
+    queue_image_cleanup()
+    flash(
+        "Cleaning up unused images in the background. Reload this page to see the result.",
+        "success",
+    )
     return redirect(url_for("admin.admin_images"))
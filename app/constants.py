@@ -14,7 +14,8 @@ class ImageFormat:
     """Allowed image file extensions and formats."""
 
     ALLOWED_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".webp")
-    ALLOWED_FORMATS = {"png", "jpeg", "gif", "webp"}  # For imghdr validation
+    ALLOWED_EXTENSIONS_SET = frozenset(ALLOWED_EXTENSIONS)  # For splitext lookups
+    ALLOWED_FORMATS = {"png", "jpeg", "gif", "webp"}  # For magic-number validation
 
 
 class Pagination:
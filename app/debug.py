@@ -0,0 +1,59 @@
+"""Helpers for catching lazy-loading and N+1 query regressions."""
+
+from contextlib import contextmanager
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Load
+
+
+class QueryCounter:
+    """Number of SQL statements seen by a count_queries() block."""
+
+    def __init__(self):
+        self.count = 0
+
+
+def strict_loading(entity):
+    """
+    Loader options that turn unexpected lazy loads into errors.
+
+    Views append these to queries whose relationships are all eager-loaded
+    explicitly. In debug and testing any relationship of ``entity`` the
+    template reads without an eager load raises instead of silently issuing
+    one query per row. The option is bound to ``entity``, so objects reached
+    through its eager loads (a post's author, who may be current_user) keep
+    their normal lazy loading.
+
+    Args:
+        entity: Mapped class the query selects, e.g. ``Post``
+
+    Returns:
+        tuple: ``(Load(entity).raiseload("*"),)`` in debug/testing, otherwise empty
+    """
+    if current_app.debug or current_app.testing:
+        return (Load(entity).raiseload("*"),)
+    return ()
+
+
+@contextmanager
+def count_queries():
+    """
+    Count SQL statements executed inside the block.
+
+    Usage:
+        with count_queries() as queries:
+            get_posts_for_user(user)
+        assert queries.count <= 3
+    """
+    counter = QueryCounter()
+
+    def _count(*args):
+        counter.count += 1
+
+    event.listen(Engine, "before_cursor_execute", _count)
+    try:
+        yield counter
+    finally:
+        event.remove(Engine, "before_cursor_execute", _count)
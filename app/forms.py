@@ -1,10 +1,25 @@
+from flask import g
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, BooleanField, SubmitField, TextAreaField
 from wtforms.validators import DataRequired, ValidationError, Email, EqualTo, Optional
 from wtforms_sqlalchemy.fields import QuerySelectMultipleField
+from sqlalchemy import exists
+from app import db
 from app.models import User, Tag
 
 
+def _exists(criterion):
+    """Check whether any row matches, without loading it into the session."""
+    return db.session.query(exists().where(criterion)).scalar()
+
+
+def _all_tags():
+    """Return all tags ordered by name, loaded at most once per request."""
+    if "_all_tags" not in g:
+        g._all_tags = Tag.query.order_by(Tag.name).all()
+    return g._all_tags
+
+
 class LoginForm(FlaskForm):
     username = StringField("Username", validators=[DataRequired()])
     password = PasswordField("Password", validators=[DataRequired()])
@@ -22,14 +37,12 @@ class RegistrationForm(FlaskForm):
     submit = SubmitField("Register")
 
     def validate_username(self, username):
-        user = User.query.filter_by(username=username.data).first()
-        if user is not None:
+        if _exists(User.username == username.data):
             raise ValidationError("Please use a different username.")
 
     def validate_email(self, email):
         if email.data:  # Only validate if email is provided
-            user = User.query.filter_by(email=email.data).first()
-            if user is not None:
+            if _exists(User.email == email.data):
                 raise ValidationError("Please use a different email address.")
 
 
@@ -41,19 +54,17 @@ class AdminRegistrationForm(FlaskForm):
         "Repeat Password", validators=[DataRequired(), EqualTo("password")]
     )
     allowed_tags = QuerySelectMultipleField(
-        "Allowed Tags", query_factory=lambda: Tag.query.all(), get_label="name"
+        "Allowed Tags", query_factory=_all_tags, get_label="name"
     )
     submit = SubmitField("Register User")
 
     def validate_username(self, username):
-        user = User.query.filter_by(username=username.data).first()
-        if user is not None:
+        if _exists(User.username == username.data):
             raise ValidationError("Please use a different username.")
 
     def validate_email(self, email):
         if email.data:  # Only validate if email is provided
-            user = User.query.filter_by(email=email.data).first()
-            if user is not None:
+            if _exists(User.email == email.data):
                 raise ValidationError("Please use a different email address.")
 
 
@@ -61,7 +72,7 @@ class AdminEditUserForm(FlaskForm):
     username = StringField("Username", validators=[DataRequired()])
     email = StringField("Email (optional)", validators=[Optional(), Email()])
     allowed_tags = QuerySelectMultipleField(
-        "Allowed Tags", query_factory=lambda: Tag.query.all(), get_label="name"
+        "Allowed Tags", query_factory=_all_tags, get_label="name"
     )
     submit = SubmitField("Update User")
 
@@ -72,16 +83,14 @@ class AdminEditUserForm(FlaskForm):
 
     def validate_username(self, username):
         if username.data != self.original_username:
-            user = User.query.filter_by(username=self.username.data).first()
-            if user is not None:
+            if _exists(User.username == self.username.data):
                 raise ValidationError("Please use a different username.")
 
     def validate_email(self, email):
         if (
             email.data and email.data != self.original_email
         ):  # Only validate if email is provided and changed
-            user = User.query.filter_by(email=self.email.data).first()
-            if user is not None:
+            if _exists(User.email == self.email.data):
                 raise ValidationError("Please use a different email address.")
 
 
@@ -104,8 +113,7 @@ class TagForm(FlaskForm):
 
     def validate_name(self, name):
         if name.data != self.original_name:
-            tag = Tag.query.filter_by(name=self.name.data).first()
-            if tag is not None:
+            if _exists(Tag.name == self.name.data):
                 raise ValidationError("Please use a different tag name.")
 
 
@@ -114,7 +122,7 @@ class PostForm(FlaskForm):
     body = TextAreaField("Body (Markdown)", validators=[DataRequired()])
     tags = QuerySelectMultipleField(
         "Tags",
-        query_factory=lambda: Tag.query.order_by(Tag.name).all(),
+        query_factory=_all_tags,
         get_label=lambda tag: f"{tag.name} [M]" if tag.is_master else tag.name,
     )
     comments_enabled = BooleanField("Enable Comments", default=True)
@@ -1,7 +1,37 @@
 from datetime import datetime
+from itertools import chain
 from app import db, login
-from werkzeug.security import generate_password_hash, check_password_hash
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+from werkzeug.security import check_password_hash
 from flask_login import UserMixin
+from sqlalchemy import event, false, inspect
+from sqlalchemy.orm import Session, load_only, validates
+
+_password_hasher = PasswordHasher(time_cost=2, memory_cost=19456, parallelism=1)
+
+
+def hash_password(password):
+    """Hash a password with argon2id."""
+    return _password_hasher.hash(password)
+
+
+def verify_password(password_hash, password):
+    """
+    Check a password against a stored hash.
+
+    Hashes created before the switch to argon2 are Werkzeug hashes and are
+    still verified with Werkzeug.
+    """
+    if not password_hash:
+        return False
+    if not password_hash.startswith("$argon2"):
+        return check_password_hash(password_hash, password)
+    try:
+        return _password_hasher.verify(password_hash, password)
+    except (VerificationError, InvalidHashError):
+        return False
+
 
 # Association table for Users and Tags
 user_tags = db.Table(
@@ -22,28 +52,46 @@ class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), index=True, unique=True)
     email = db.Column(db.String(120), index=True, unique=True, nullable=True)
-    password_hash = db.Column(db.String(128))
+    password_hash = db.Column(db.String(255))
     is_admin = db.Column(db.Boolean, default=False)
-    posts = db.relationship("Post", backref="author", lazy="dynamic")
+    posts = db.relationship("Post", backref="author", lazy="select")
 
     # Relationship to tags that the user is allowed to see
     allowed_tags = db.relationship(
         "Tag",
         secondary=user_tags,
-        backref=db.backref("users", lazy="dynamic"),
-        lazy="dynamic",
+        backref=db.backref("users", lazy="select"),
+        lazy="select",
     )
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return verify_password(self.password_hash, password)
+
+    def password_needs_rehash(self):
+        """Check if the stored hash is a legacy or outdated-parameter hash."""
+        if not self.password_hash.startswith("$argon2"):
+            return True
+        return _password_hasher.check_needs_rehash(self.password_hash)
 
     def get_tag_ids(self):
         """Get list of allowed tag IDs for this user."""
         return [tag.id for tag in self.allowed_tags]
 
+    @property
+    def tag_id_set(self):
+        """Frozenset of allowed tag IDs, computed once per loaded instance."""
+        if not hasattr(self, "_tag_id_set"):
+            self._tag_id_set = frozenset(tag.id for tag in self.allowed_tags)
+        return self._tag_id_set
+
+    @validates("allowed_tags", include_removes=True)
+    def _invalidate_tag_id_set(self, key, tag, is_remove):
+        self.__dict__.pop("_tag_id_set", None)
+        return tag
+
     def can_view_post(self, post):
         """Check if this user can view a specific post."""
         from app.services.access_control import user_can_view_post
@@ -56,27 +104,44 @@ class User(UserMixin, db.Model):
 
 @login.user_loader
 def load_user(id):
-    return User.query.get(int(id))
+    # Requests only read these off current_user; anything else loads on access
+    return db.session.get(
+        User, int(id), options=[load_only(User.id, User.username, User.is_admin)]
+    )
 
 
 class Post(db.Model):
+    # Published-post listings filter on is_draft and sort by timestamp
+    __table_args__ = (db.Index("ix_post_draft_ts", "is_draft", "timestamp"),)
+
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(140))
     body = db.Column(db.Text)
+    # Sanitized HTML of body, filled by _fill_rendered_body_cache()
+    rendered_body_cache = db.Column(db.Text)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"))
     comments_enabled = db.Column(db.Boolean, default=True)
-    is_draft = db.Column(db.Boolean, default=False, index=True)
+    is_draft = db.Column(db.Boolean, default=False)
+    # Denormalized from tags so access checks can skip the tag rows;
+    # kept in step by _update_post_tag_flags()
+    has_master_tags = db.Column(
+        db.Boolean, default=False, server_default=false(), nullable=False
+    )
+    has_regular_tags = db.Column(
+        db.Boolean, default=False, server_default=false(), nullable=False
+    )
     comments = db.relationship(
-        "Comment", backref="post", lazy="dynamic", cascade="all, delete-orphan"
+        "Comment", backref="post", lazy="select", cascade="all, delete-orphan"
     )
 
-    # Relationship to tags
+    # Relationship to tags. Not eager by default: access checks go by the
+    # has_*_tags flags first, and the views that render tags selectinload them
     tags = db.relationship(
         "Tag",
         secondary=post_tags,
-        backref=db.backref("posts", lazy="dynamic"),
-        lazy="dynamic",
+        backref=db.backref("posts", lazy="select"),
+        lazy="select",
     )
 
     def get_tag_ids(self):
@@ -85,14 +150,41 @@ class Post(db.Model):
 
     def is_public(self):
         """Check if this post is public (has no tags)."""
-        return not self.tags.all()
+        return not (self.has_master_tags or self.has_regular_tags)
 
     @property
-    def rendered_body(self):
-        """Get HTML-rendered markdown body."""
-        from app.utils import render_markdown
+    def tag_id_partition(self):
+        """(master, regular) frozensets of tag IDs, computed once per loaded instance."""
+        if not hasattr(self, "_tag_id_partition"):
+            tags = self.tags
+            self._tag_id_partition = (
+                frozenset(tag.id for tag in tags if tag.is_master),
+                frozenset(tag.id for tag in tags if not tag.is_master),
+            )
+        return self._tag_id_partition
+
+    @validates("tags", include_removes=True)
+    def _invalidate_tag_id_partition(self, key, tag, is_remove):
+        self.__dict__.pop("_tag_id_partition", None)
+        return tag
 
-        return render_markdown(self.body)
+    @property
+    def rendered_body(self):
+        """Get HTML-rendered markdown body, stored with the row on save."""
+        if self.rendered_body_cache is not None:
+            return self.rendered_body_cache
+        # Rows saved before the cache column existed
+        if not hasattr(self, "_rendered_body"):
+            from app.utils import render_markdown
+
+            self._rendered_body = render_markdown(self.body)
+        return self._rendered_body
+
+    @validates("body")
+    def _invalidate_rendered_body(self, key, body):
+        self.__dict__.pop("_rendered_body", None)
+        self.rendered_body_cache = None
+        return body
 
     def is_visible_to_user(self, user):
         """Check if this post is visible to a user."""
@@ -114,8 +206,13 @@ class Tag(db.Model):
 
 
 class Comment(db.Model):
+    # Comments are always fetched per post in chronological order
+    __table_args__ = (db.Index("ix_comment_post_ts", "post_id", "timestamp"),)
+
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.Text)
+    # Sanitized HTML of body, filled by _fill_rendered_body_cache()
+    rendered_body_cache = db.Column(db.Text)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     post_id = db.Column(db.Integer, db.ForeignKey("post.id"), nullable=False)
     user_id = db.Column(
@@ -125,10 +222,21 @@ class Comment(db.Model):
 
     @property
     def rendered_body(self):
-        """Get HTML-rendered markdown body."""
-        from app.utils import render_markdown
-
-        return render_markdown(self.body)
+        """Get HTML-rendered markdown body, stored with the row on save."""
+        if self.rendered_body_cache is not None:
+            return self.rendered_body_cache
+        # Rows saved before the cache column existed
+        if not hasattr(self, "_rendered_body"):
+            from app.utils import render_markdown
+
+            self._rendered_body = render_markdown(self.body)
+        return self._rendered_body
+
+    @validates("body")
+    def _invalidate_rendered_body(self, key, body):
+        self.__dict__.pop("_rendered_body", None)
+        self.rendered_body_cache = None
+        return body
 
     @property
     def author_display_name(self):
@@ -139,3 +247,61 @@ class Comment(db.Model):
 
     def __repr__(self):
         return f"<Comment {self.body[:20]}...>"
+
+
+def _fill_rendered_body_cache(mapper, connection, target):
+    """Render the Markdown body once when a post or comment is saved."""
+    if target.rendered_body_cache is None and target.body is not None:
+        from app.utils import render_markdown
+
+        target.rendered_body_cache = render_markdown(target.body)
+
+
+for _model in (Post, Comment):
+    event.listen(_model, "before_insert", _fill_rendered_body_cache)
+    event.listen(_model, "before_update", _fill_rendered_body_cache)
+
+
+def _drop_tag_id_set(target, *args):
+    """Forget the memoized tag ids once the user's attributes are expired or reloaded."""
+    target.__dict__.pop("_tag_id_set", None)
+
+
+def _drop_tag_id_partition(target, *args):
+    """Forget the memoized tag partition once the post's attributes are expired or reloaded."""
+    target.__dict__.pop("_tag_id_partition", None)
+
+
+for _event in ("expire", "refresh"):
+    event.listen(User, _event, _drop_tag_id_set)
+    event.listen(Post, _event, _drop_tag_id_partition)
+
+
+@event.listens_for(Session, "before_flush")
+def _update_post_tag_flags(session, flush_context, instances):
+    """
+    Recompute Post.has_master_tags / has_regular_tags before each flush.
+
+    A post's flags change when its tags change, when one of its tags switches
+    between master and regular, or when one of its tags is deleted.
+    """
+    deleted_tags = {obj for obj in session.deleted if isinstance(obj, Tag)}
+    posts = set()
+    for obj in chain(session.new, session.dirty):
+        if isinstance(obj, Post):
+            if obj in session.new or inspect(obj).attrs.tags.history.has_changes():
+                posts.add(obj)
+        elif isinstance(obj, Tag):
+            if inspect(obj).attrs.is_master.history.has_changes():
+                posts.update(obj.posts)
+    for tag in deleted_tags:
+        posts.update(tag.posts)
+
+    for post in posts:
+        if post in session.deleted:
+            continue
+        # A tag may have switched between master and regular under the memo
+        _drop_tag_id_partition(post)
+        tags = [tag for tag in post.tags if tag not in deleted_tags]
+        post.has_master_tags = any(tag.is_master for tag in tags)
+        post.has_regular_tags = any(not tag.is_master for tag in tags)
@@ -1,13 +1,30 @@
-from flask import render_template, flash, redirect, url_for, request, abort, make_response, send_from_directory, current_app
-import os
+from flask import render_template, flash, redirect, url_for, request, abort, make_response, current_app
+import secrets
+from functools import lru_cache
+from sqlalchemy import bindparam, select
+from sqlalchemy.orm import joinedload, selectinload
 from app import db, limiter, main_bp  # Import main_bp, db and limiter
 from app.forms import LoginForm, CommentForm
 from flask_login import current_user, login_user, logout_user, login_required
-from app.models import User, Post, Comment
+from app.models import User, Post, Comment, hash_password, verify_password
 from app.utils import safe_db_commit
-from app.services.access_control import get_posts_for_user, user_can_view_post
+from app.debug import strict_loading
+from app.services.access_control import (
+    get_posts_for_user,
+    user_can_view_post,
+    visible_posts_query,
+)
 from urllib.parse import urlsplit
 
+# Built once so every login attempt reuses the same cached compiled statement
+_LOGIN_SELECT = select(User).where(User.username == bindparam("username"))
+
+
+@lru_cache(maxsize=1)
+def _dummy_password_hash():
+    """Hash checked for unknown usernames so misses cost as much as wrong passwords."""
+    return hash_password(secrets.token_hex(16))
+
 
 @main_bp.route("/")
 @main_bp.route("/index")
@@ -26,7 +43,9 @@ def post(post_id):
     if current_app.config.get("REQUIRE_LOGIN", True) and not current_user.is_authenticated:
         return redirect(url_for("main.login", next=url_for("main.post", post_id=post_id)))
 
-    post = Post.query.get_or_404(post_id)
+    post = Post.query.options(
+        joinedload(Post.author), selectinload(Post.tags), *strict_loading(Post)
+    ).get_or_404(post_id)
 
     # Check if user has access to view this post
     if not user_can_view_post(current_user, post):
@@ -82,10 +101,18 @@ def login():
         return redirect(url_for("main.index"))  # Use blueprint name
     form = LoginForm()
     if form.validate_on_submit():
-        user = User.query.filter_by(username=form.username.data).first()
+        user = db.session.execute(
+            _LOGIN_SELECT, {"username": form.username.data}
+        ).scalar_one_or_none()
+        if user is None:
+            verify_password(_dummy_password_hash(), form.password.data)
         if user is None or not user.check_password(form.password.data):
             flash("Invalid username or password", "error")
             return redirect(url_for("main.login"))  # Use blueprint name
+        if user.password_needs_rehash():
+            # Upgrade legacy hashes while the plaintext password is at hand
+            user.set_password(form.password.data)
+            safe_db_commit(db.session)
         login_user(user, remember=form.remember_me.data)
         next_page = request.args.get("next")
         if not next_page or urlsplit(next_page).netloc != "":
@@ -123,11 +150,14 @@ def rss_feed():
         abort(401)  # Unauthorized for RSS if login required
     
     # Use service to get posts this user is allowed to see
-    posts = get_posts_for_user(current_user)
-    # Exclude drafts from RSS feed (even for admins)
-    visible_posts = [p for p in posts if not p.is_draft]
-    # Limit to 20 latest posts
-    visible_posts = visible_posts[:20]
+    visible_posts = (
+        visible_posts_query(current_user)
+        # Exclude drafts from RSS feed (even for admins)
+        .filter(Post.is_draft.is_(False))
+        # Limit to 20 latest posts
+        .limit(20)
+        .all()
+    )
 
     response = make_response(render_template("rss.xml", posts=visible_posts))
     response.headers["Content-Type"] = "application/rss+xml"
@@ -143,12 +173,3 @@ def toggle_theme():
     response = redirect(request.referrer or url_for("main.index"))
     response.set_cookie("theme", new_theme, max_age=30 * 24 * 60 * 60, samesite="Lax")
     return response
-
-
-@main_bp.route("/favicon.ico")
-def favicon():
-    return send_from_directory(
-        os.path.join(main_bp.root_path, "static", "assets"),
-        "favicon.ico",
-        mimetype="image/vnd.microsoft.icon",
-    )
@@ -1,14 +1,28 @@
+import hashlib
+from itertools import chain
 from flask import current_app
-from app.models import Post
+from cachelib import BaseCache
+from sqlalchemy import and_, event, exists, false, or_
+from sqlalchemy.orm import Session, joinedload, selectinload
+from app import cache
+from app.debug import strict_loading
+from app.models import Post, Tag, post_tags
 
 
-def user_can_view_post(user, post):
+def _feed_options():
+    """Loader options for post lists: everything the feed templates read."""
+    return (joinedload(Post.author), selectinload(Post.tags), *strict_loading(Post))
+
+
+def user_can_view_post(user, post, user_tag_ids=None):
     """
     Check if a user can view a specific post.
 
     Args:
         user: Current user (can be anonymous via current_user)
         post: Post object to check access for
+        user_tag_ids (set, optional): IDs of the user's allowed tags. Callers
+            checking many posts compute this once and pass it in.
 
     Returns:
         bool: True if user can view the post, False otherwise
@@ -26,10 +40,6 @@ def user_can_view_post(user, post):
     if user.is_authenticated and user.is_admin:
         return True
 
-    # Draft posts only visible to admins
-    if post.is_draft:
-        return False
-
     # Anonymous users handling
     if not user.is_authenticated:
         # If login is required (default), anonymous users see nothing
@@ -38,46 +48,117 @@ def user_can_view_post(user, post):
         # If login is NOT required, anonymous users can ONLY see untagged posts
         # (they continue to the tag check below, which handles untagged posts)
 
-    post_tags = post.tags.all()
+    # Draft posts only visible to admins
+    if post.is_draft:
+        return False
 
     # Posts with no tags are visible to all authenticated users (and guests if allowed)
-    if not post_tags:
+    if post.is_public():
         return True
 
     # For posts with tags, anonymous users can NEVER see them
     if not user.is_authenticated:
         return False
 
-    user_tag_ids = {t.id for t in user.allowed_tags.all()}
-    master_tags_on_post = {t.id for t in post_tags if t.is_master}
-    regular_tags_on_post = {t.id for t in post_tags if not t.is_master}
+    if user_tag_ids is None:
+        user_tag_ids = user.tag_id_set
+    return _tag_rules_allow(post, user_tag_ids)
 
-    # Master tag check (AND logic)
-    if master_tags_on_post:
-        if not master_tags_on_post.issubset(user_tag_ids):
-            return False
 
-    # Regular tag check (OR logic)
-    if regular_tags_on_post:
-        if not regular_tags_on_post.isdisjoint(user_tag_ids):
-            # User has the required master tags (if any) and at least one regular tag
-            return True
-        else:
-            # User has the master tags but is missing any of the regular tags
-            return False
+def _tag_rules_allow(post, user_tag_ids):
+    """
+    Apply the master/regular tag rules of a post to a set of allowed tag IDs.
 
-    # If we are here, it means the post had only master tags, and the user has them.
-    if master_tags_on_post:
+    _tag_rules_clause() is the SQL version of the same rules; keep them in step.
+    """
+    if post.is_public():
         return True
 
-    # Fallback, should not be reached
-    return False
+    master_tags_on_post, regular_tags_on_post = post.tag_id_partition
+
+    # Master tag check (AND logic)
+    if master_tags_on_post and not master_tags_on_post.issubset(user_tag_ids):
+        return False
+
+    # Regular tag check (OR logic): at least one of them, if there are any
+    if regular_tags_on_post and regular_tags_on_post.isdisjoint(user_tag_ids):
+        return False
+
+    # User has the required master tags (if any) and at least one regular tag (if any)
+    return True
+
+
+def _post_has_tag(*criteria):
+    """EXISTS over the tags attached to the outer Post row."""
+    return exists().where(
+        post_tags.c.post_id == Post.id, post_tags.c.tag_id == Tag.id, *criteria
+    )
+
+
+def _tag_rules_clause(user_tag_ids):
+    """
+    SQL filter equivalent to _tag_rules_allow() for a set of allowed tag IDs.
+
+    No master tag on the post may be missing from the set, and if the post has
+    regular tags, at least one of them must be in the set. The denormalized
+    flags on Post let the database skip the subqueries for posts without
+    master or regular tags.
+    """
+    return and_(
+        or_(
+            Post.has_master_tags.is_(False),
+            ~_post_has_tag(Tag.is_master.is_(True), Tag.id.not_in(user_tag_ids)),
+        ),
+        or_(
+            Post.has_regular_tags.is_(False),
+            _post_has_tag(Tag.is_master.is_(False), Tag.id.in_(user_tag_ids)),
+        ),
+    )
+
+
+def visible_posts_query(user):
+    """
+    Build a query for the posts a user is allowed to see.
+
+    The access rules of user_can_view_post are applied in SQL, so only
+    visible rows are loaded and callers can add limits or pagination.
+
+    Args:
+        user: Current user (can be anonymous via current_user)
+
+    Returns:
+        Query: Post query ordered by timestamp descending
+    """
+    query = Post.query.options(*_feed_options()).order_by(Post.timestamp.desc())
+
+    # Admin bypass - see everything including drafts
+    if user.is_authenticated and user.is_admin:
+        return query
+
+    query = query.filter(Post.is_draft.is_(False))
+
+    # Anonymous users handling
+    if not user.is_authenticated:
+        # If login is required, they see nothing
+        if current_app.config.get("REQUIRE_LOGIN", True):
+            return query.filter(false())
+        # Otherwise, they see only published, untagged posts
+        return query.filter(
+            Post.has_master_tags.is_(False), Post.has_regular_tags.is_(False)
+        )
+
+    return query.filter(_tag_rules_clause(user.tag_id_set))
 
 
 def get_posts_for_user(user):
     """
     Get all posts visible to a user.
 
+    The IDs of the visible posts are cached per tag set (users with the same
+    allowed tags see the same posts), so a cache hit replaces the visibility
+    filter with a plain ID lookup. Any committed change to posts or tags
+    starts a new cache generation. The cache is off unless CACHE_TYPE is set.
+
     Args:
         user: Current user (can be anonymous via current_user)
 
@@ -86,24 +167,91 @@ def get_posts_for_user(user):
     """
     # Admin bypass - see everything including drafts
     if user.is_authenticated and user.is_admin:
-        return Post.query.order_by(Post.timestamp.desc()).all()
+        return visible_posts_query(user).all()
 
-    # Anonymous users handling
     if not user.is_authenticated:
         # If login is required, they see nothing
         if current_app.config.get("REQUIRE_LOGIN", True):
             return []
-        # Otherwise, they see only published, untagged posts
-        # We handle this via the loop below to keep logic consistent
+        signature = "guest"
+    else:
+        signature = _tag_signature(user.tag_id_set)
+
+    # The cache only saves work: if the backend is down, query directly
+    try:
+        cache_key = _visible_ids_cache_key(signature)
+        post_ids = cache.get(cache_key)
+    except Exception as e:
+        current_app.logger.warning(f"Feed cache unavailable: {e}")
+        return visible_posts_query(user).all()
+
+    if post_ids is None:
+        posts = visible_posts_query(user).all()
+        try:
+            cache.set(cache_key, [post.id for post in posts])
+        except Exception as e:
+            current_app.logger.warning(f"Feed cache unavailable: {e}")
+        return posts
 
-    # For authenticated users, filter posts in Python for correct logic
-    all_posts = (
-        Post.query.filter_by(is_draft=False).order_by(Post.timestamp.desc()).all()
+    if not post_ids:
+        return []
+    return (
+        Post.query.options(*_feed_options())
+        .filter(Post.id.in_(post_ids))
+        .order_by(Post.timestamp.desc())
+        .all()
     )
 
-    visible_posts = []
-    for post in all_posts:
-        if user_can_view_post(user, post):
-            visible_posts.append(post)
 
-    return visible_posts
+_VISIBILITY_GENERATION_KEY = "vis:generation"
+
+
+def _tag_signature(user_tag_ids):
+    """Short stable digest of a set of tag IDs."""
+    joined = ",".join(map(str, sorted(user_tag_ids)))
+    return hashlib.blake2b(joined.encode(), digest_size=8).hexdigest()
+
+
+def _visible_ids_cache_key(signature):
+    generation = cache.get(_VISIBILITY_GENERATION_KEY) or 0
+    return f"vis:{generation}:{signature}"
+
+
+@event.listens_for(Session, "after_flush")
+def _note_visibility_changes(session, flush_context):
+    # new/dirty/deleted still hold the flushed objects at this point
+    if any(
+        isinstance(obj, (Post, Tag))
+        for obj in chain(session.new, session.dirty, session.deleted)
+    ):
+        session.info["visibility_changed"] = True
+
+
+def _next_visibility_generation():
+    backend = cache.cache
+    # The counter must never expire: if it reset, old vis:<n>:* entries with
+    # outdated visibility would be served again. add() creates it without a
+    # timeout; Redis INCR and memcached incr keep that when incrementing.
+    backend.add(_VISIBILITY_GENERATION_KEY, 0, timeout=0)
+    if type(backend).inc is BaseCache.inc:
+        # The generic inc re-sets the key with the default timeout
+        generation = backend.get(_VISIBILITY_GENERATION_KEY) or 0
+        backend.set(_VISIBILITY_GENERATION_KEY, generation + 1, timeout=0)
+    else:
+        backend.inc(_VISIBILITY_GENERATION_KEY)
+
+
+@event.listens_for(Session, "after_commit")
+def _bump_visibility_generation(session):
+    if session.info.pop("visibility_changed", False):
+        # The data is already committed; a cache outage must not turn that
+        # into an error for the caller
+        try:
+            _next_visibility_generation()
+        except Exception as e:
+            current_app.logger.error(f"Could not expire the feed cache: {e}")
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_visibility_changes(session):
+    session.info.pop("visibility_changed", None)
@@ -0,0 +1,77 @@
+"""Work that runs outside the request that asked for it."""
+
+from concurrent.futures import ThreadPoolExecutor
+import click
+from flask import current_app
+from sqlalchemy import select, update
+from app import db
+from app.models import Comment, Post
+from app.utils import cleanup_unused_images, render_markdown
+
+# One background thread per worker process; queued jobs run one after another
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="picoblog-tasks")
+
+
+def _run_image_cleanup(app):
+    with app.app_context():
+        try:
+            deleted_count, deleted_files = cleanup_unused_images()
+        except Exception:
+            app.logger.exception("Background image cleanup failed")
+            return
+        app.logger.info(
+            f"Image cleanup deleted {deleted_count} unused image(s): "
+            f"{', '.join(deleted_files) or '-'}"
+        )
+
+
+def queue_image_cleanup():
+    """
+    Run cleanup_unused_images() on a background thread.
+
+    The admin request returns straight away; the result goes to the app log.
+
+    Returns:
+        Future: Completes when the cleanup has finished
+    """
+    return _executor.submit(_run_image_cleanup, current_app._get_current_object())
+
+
+@click.command("cleanup-images")
+def cleanup_images_command():
+    """Delete uploaded images that no post or comment references."""
+    deleted_count, deleted_files = cleanup_unused_images()
+    for filename in deleted_files:
+        click.echo(filename)
+    click.echo(f"Deleted {deleted_count} unused image(s).")
+
+
+@click.command("rerender-markdown")
+def rerender_markdown_command():
+    """
+    Re-render the stored HTML of every post and comment.
+
+    rendered_body_cache is only refreshed when a body is edited, so run this
+    after changing MARKDOWN_SANITIZER or the Markdown allowlists.
+    """
+    updated = 0
+    for model in (Post, Comment):
+        # Collect only the rows whose HTML changed, then write them in one
+        # bulk UPDATE by primary key (bypassing the before_update listener)
+        rows = db.session.execute(
+            select(model.id, model.body, model.rendered_body_cache).execution_options(
+                yield_per=500
+            )
+        )
+        changes = []
+        for row in rows:
+            if row.body is None:
+                continue
+            html = render_markdown(row.body)
+            if html != row.rendered_body_cache:
+                changes.append({"id": row.id, "rendered_body_cache": html})
+        if changes:
+            db.session.execute(update(model), changes)
+        updated += len(changes)
+    db.session.commit()
+    click.echo(f"Re-rendered {updated} post(s) and comment(s).")
@@ -1,13 +1,54 @@
 """Utility functions for the application."""
 
+import hashlib
+import io
 import os
 import secrets
-import imghdr
 import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from flask import current_app, flash
 import markdown2
 import bleach
-from PIL import Image
+import nh3
+from PIL import Image, ImageOps
+
+try:
+    import pyvips
+except (ImportError, OSError):
+    # Optional: pip install "picoblog[vips]" (needs libvips); Pillow is the fallback
+    pyvips = None
+from sqlalchemy import select
+from urllib.parse import unquote
+from app.constants import ImageFormat
+
+# Upload paths in a post or comment body: the whole path segment after
+# /static/uploads/, up to whitespace, a quote, a bracket or a query/fragment
+_UPLOAD_PATH_RE = re.compile(r"/static/uploads/([^\s\"'()<>\[\]?#]+)")
+
+# Leading bytes of each accepted image format (checked instead of imghdr,
+# which is deprecated and removed in Python 3.13)
+_IMAGE_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"RIFF", "webp"),
+)
+
+# Opening line of a fenced code block with a language, e.g. ```python
+_LANG_MARKER_RE = re.compile(r"^```(\w+)", re.MULTILINE)
+
+
+def _inject_lang_marker(match):
+    """Prefix a fenced code block with a marker span carrying its language."""
+    lang = match.group(1)
+    if lang:
+        return (
+            f'<span class="code-lang-marker" data-lang="{lang}"></span>\n\n'
+            + match.group(0)
+        )
+    return match.group(0)
 
 
 def safe_db_commit(session, success_message=None, error_message=None):
@@ -43,6 +84,10 @@ def render_markdown(text):
 
     Markdown2 automatically uses Pygments for syntax highlighting when it's installed.
     The CSS styles for Pygments classes are included in the compiled output.css.
+    Rendered output is kept in a process-wide LRU cache keyed by the source text
+    and the app's sanitizer policy, so bodies shown on several pages are only
+    parsed and sanitized once, and apps with different allowlists never share
+    entries.
 
     Args:
         text (str): Markdown text to render
@@ -50,21 +95,47 @@ def render_markdown(text):
     Returns:
         str: Sanitized HTML output with syntax-highlighted code blocks
     """
+    return _render_markdown_cached(
+        current_app.config["MARKDOWN_SANITIZER"], _allowlist_digest(), text
+    )
+
+
+def _allowlist_digest():
+    """
+    Short digest of the Markdown allowlists in the config.
+
+    Part of the render cache key. Done once per app and kept in
+    app.extensions, like the nh3 allowlists.
+    """
+    digest = current_app.extensions.get("markdown_allowlist_digest")
+    if digest is None:
+        config = current_app.config
+        allowlists = (
+            sorted(config["MARKDOWN_ALLOWED_TAGS"]),
+            sorted(
+                (tag, sorted(attrs))
+                for tag, attrs in config["MARKDOWN_ALLOWED_ATTRIBUTES"].items()
+            ),
+            sorted(config["MARKDOWN_ALLOWED_PROTOCOLS"]),
+        )
+        digest = current_app.extensions["markdown_allowlist_digest"] = hashlib.blake2b(
+            repr(allowlists).encode(), digest_size=8
+        ).hexdigest()
+    return digest
+
+
+@lru_cache(maxsize=1024)
+def _render_markdown_cached(sanitizer, allowlist_digest, text):
+    """
+    Render and sanitize Markdown; see render_markdown().
+
+    sanitizer and allowlist_digest only key the cache: they describe the
+    current app's config, which the sanitizers read directly.
+    """
 
     # Inject temporary language markers for fenced code blocks
     # This allows the frontend to identify the language of each block
-    def inject_lang_marker(match):
-        lang = match.group(1)
-        if lang:
-            return (
-                f'<span class="code-lang-marker" data-lang="{lang}"></span>\n\n'
-                + match.group(0)
-            )
-        return match.group(0)
-
-    text_with_markers = re.sub(
-        r"^```(\w+)", inject_lang_marker, text, flags=re.MULTILINE
-    )
+    text_with_markers = _LANG_MARKER_RE.sub(_inject_lang_marker, text)
 
     # Render Markdown to HTML with comprehensive extras
     # markdown2 will automatically use Pygments for syntax highlighting when available
@@ -81,15 +152,40 @@ def render_markdown(text):
     )
 
     # Then sanitize the HTML to prevent XSS (using config values)
-    clean_html = bleach.clean(
-        html,
-        tags=current_app.config["MARKDOWN_ALLOWED_TAGS"],
-        attributes=current_app.config["MARKDOWN_ALLOWED_ATTRIBUTES"],
-        protocols=current_app.config["MARKDOWN_ALLOWED_PROTOCOLS"],
-        strip=True,  # Strip disallowed tags instead of escaping them
-    )
+    if sanitizer == "bleach":
+        return bleach.clean(
+            html,
+            tags=current_app.config["MARKDOWN_ALLOWED_TAGS"],
+            attributes=current_app.config["MARKDOWN_ALLOWED_ATTRIBUTES"],
+            protocols=current_app.config["MARKDOWN_ALLOWED_PROTOCOLS"],
+            strip=True,  # Strip disallowed tags instead of escaping them
+        )
 
-    return clean_html
+    return nh3.clean(html, **_nh3_allowlists())
+
+
+def _nh3_allowlists():
+    """
+    Convert the Markdown allowlists from the config into nh3 arguments.
+
+    Done once per app and kept in app.extensions. "style" attributes are left
+    out: bleach empties them without a CSS sanitizer, so dropping them keeps
+    the output the same. link_rel=None stops nh3 from adding its own rel
+    attribute to links, as bleach never did.
+    """
+    allowlists = current_app.extensions.get("nh3_allowlists")
+    if allowlists is None:
+        config = current_app.config
+        allowlists = current_app.extensions["nh3_allowlists"] = {
+            "tags": set(config["MARKDOWN_ALLOWED_TAGS"]),
+            "attributes": {
+                tag: set(attrs) - {"style"}
+                for tag, attrs in config["MARKDOWN_ALLOWED_ATTRIBUTES"].items()
+            },
+            "url_schemes": set(config["MARKDOWN_ALLOWED_PROTOCOLS"]),
+            "link_rel": None,
+        }
+    return allowlists
 
 
 def allowed_file(filename):
@@ -109,7 +205,7 @@ def allowed_file(filename):
     )
 
 
-def validate_image(file_stream):
+def validate_image(data):
     """
     Validate that the uploaded file is actually an image by checking its content.
 
@@ -117,26 +213,27 @@ def validate_image(file_stream):
     preventing malicious files with valid extensions from being uploaded.
 
     Args:
-        file_stream: File stream to validate
+        data (bytes): Contents of the uploaded file (only the header is checked)
 
     Returns:
         bool: True if the file is a valid image, False otherwise
     """
-    # Save current position
-    pos = file_stream.tell()
-
-    # Read header for validation
-    header = file_stream.read(512)
-
-    # Reset stream position
-    file_stream.seek(pos)
-
     # Check actual image format using magic numbers
-    format = imghdr.what(None, header)
+    format = _detect_image_format(data[:12])
 
     # Verify format matches allowed extensions
-    allowed_formats = {"png", "jpeg", "gif", "webp"}
-    return format in allowed_formats
+    return format in ImageFormat.ALLOWED_FORMATS
+
+
+def _detect_image_format(header):
+    """Return the image format named by the file's magic number, or None."""
+    for signature, format in _IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            # RIFF is a generic container; WebP names itself at offset 8
+            if format == "webp" and header[8:12] != b"WEBP":
+                return None
+            return format
+    return None
 
 
 def save_uploaded_file(file):
@@ -152,8 +249,12 @@ def save_uploaded_file(file):
     if not file or not allowed_file(file.filename):
         return None
 
+    # Read the upload once; validation and decoding both work on these bytes,
+    # so what gets decoded is exactly what was validated
+    data = file.stream.read()
+
     # Validate file content (check magic numbers)
-    if not validate_image(file.stream):
+    if not validate_image(data):
         current_app.logger.warning(f"Invalid image file rejected: {file.filename}")
         return None
 
@@ -165,21 +266,14 @@ def save_uploaded_file(file):
     os.makedirs(current_app.config["UPLOAD_FOLDER"], exist_ok=True)
     file_path = os.path.join(current_app.config["UPLOAD_FOLDER"], filename)
 
-    try:
-        # Open image with Pillow
-        img = Image.open(file.stream)
-
-        # Resize if image is too wide
-        max_width = current_app.config.get("IMAGE_MAX_WIDTH", 1200)
-        if img.width > max_width:
-            ratio = max_width / float(img.width)
-            new_height = int(float(img.height) * ratio)
-            img = img.resize((max_width, new_height), Image.Resampling.LANCZOS)
+    max_width = current_app.config.get("IMAGE_MAX_WIDTH", 1200)
+    quality = current_app.config.get("IMAGE_QUALITY", 85)
 
-        # Save as WebP with optimized quality
-        # Pillow handles transparency automatically when saving to WEBP if mode is RGBA
-        quality = current_app.config.get("IMAGE_QUALITY", 85)
-        img.save(file_path, "WEBP", quality=quality, method=6)
+    try:
+        if pyvips is not None:
+            _save_webp_vips(data, file_path, max_width, quality)
+        else:
+            _save_webp_pillow(data, file_path, max_width, quality)
 
         return filename
     except Exception as e:
@@ -187,6 +281,64 @@ def save_uploaded_file(file):
         return None
 
 
+def _save_webp_vips(data, file_path, max_width, quality):
+    """Downscale to max_width and encode as WebP with libvips."""
+    # thumbnail_buffer applies the EXIF orientation, shrinks while decoding and
+    # never upscales (size="down"); alpha is kept as is. It fits the image into
+    # a width x height box, so give it an effectively unlimited height: only the
+    # width is capped, as with Pillow
+    img = pyvips.Image.thumbnail_buffer(data, max_width, height=10_000_000, size="down")
+    # Drop EXIF/XMP/ICC metadata (camera details, GPS); "strip" before 8.15
+    if pyvips.at_least_libvips(8, 15):
+        img.webpsave(file_path, Q=quality, effort=6, keep="none")
+    else:
+        img.webpsave(file_path, Q=quality, effort=6, strip=True)
+
+
+def _save_webp_pillow(data, file_path, max_width, quality):
+    """Downscale to max_width and encode as WebP with Pillow."""
+    # Apply the EXIF orientation to the pixels, as libvips does: the metadata
+    # is not written to the WebP, so it could not rotate the image later
+    img = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+
+    # Resize if image is too wide
+    if img.width > max_width:
+        ratio = max_width / float(img.width)
+        new_height = int(float(img.height) * ratio)
+        img = img.resize((max_width, new_height), Image.Resampling.LANCZOS)
+
+    # Save as WebP with optimized quality; without an exif argument Pillow
+    # writes no EXIF. Pillow handles transparency automatically when saving to
+    # WEBP if mode is RGBA
+    img.save(file_path, "WEBP", quality=quality, method=6)
+
+
+def list_uploaded_images(upload_folder):
+    """
+    List the image files in the upload folder.
+
+    os.scandir reports each entry's type from the directory read itself, so
+    there is no extra stat call per file.
+
+    Args:
+        upload_folder (str): Directory to list
+
+    Returns:
+        list: File names with an allowed image extension (empty if the folder is missing)
+    """
+    if not os.path.exists(upload_folder):
+        return []
+
+    with os.scandir(upload_folder) as entries:
+        return [
+            entry.name
+            for entry in entries
+            if entry.is_file(follow_symlinks=False)
+            and os.path.splitext(entry.name)[1].lower()
+            in ImageFormat.ALLOWED_EXTENSIONS_SET
+        ]
+
+
 def cleanup_unused_images():
     """
     Find and delete images that are not referenced in any post or comment.
@@ -194,48 +346,59 @@ def cleanup_unused_images():
     Returns:
         tuple: (deleted_count, deleted_files) - number of deleted files and their names
     """
+    from app import db
     from app.models import Post, Comment
 
     upload_folder = current_app.config["UPLOAD_FOLDER"]
 
-    # Check if upload folder exists
-    if not os.path.exists(upload_folder):
-        return 0, []
-
-    # Get all image files
-    image_files = [
-        f
-        for f in os.listdir(upload_folder)
-        if os.path.isfile(os.path.join(upload_folder, f))
-        and f.lower().endswith((".png", ".jpg", ".jpeg", ".gif", ".webp"))
-    ]
-
+    image_files = list_uploaded_images(upload_folder)
     if not image_files:
         return 0, []
 
-    # Find unused images by checking database for each file
-    unused_images = []
-    for image_file in image_files:
-        # Check if filename is referenced in any post or comment body
-        # Using contains() for case-sensitive substring matching
-        post_count = Post.query.filter(Post.body.contains(image_file)).count()
-        comment_count = Comment.query.filter(Comment.body.contains(image_file)).count()
-
-        # If not referenced anywhere, mark as unused
-        if post_count == 0 and comment_count == 0:
-            unused_images.append(image_file)
+    def bodies():
+        # Every post and comment body in one query, streamed in batches
+        # rather than loaded all at once
+        return db.session.execute(
+            select(Post.body).union_all(select(Comment.body)),
+            execution_options={"yield_per": 500},
+        ).scalars()
+
+    # Collect every /static/uploads/ path referenced by a post or comment, then
+    # compare against the directory listing instead of querying per file
+    referenced = {
+        unquote(path).lower()
+        for body in bodies()
+        if body
+        for path in _UPLOAD_PATH_RE.findall(body)
+    }
+    unused_images = [f for f in image_files if f.lower() not in referenced]
+
+    # Deleting is destructive, so keep anything whose name still appears
+    # anywhere in a body (bare names, other URL forms), like a per-file
+    # substring check would. Only the remaining candidates are checked.
+    if unused_images:
+        for body in bodies():
+            if body and unused_images:
+                lowered = body.lower()
+                unused_images = [f for f in unused_images if f.lower() not in lowered]
+
+    def remove(image_file):
+        try:
+            os.remove(os.path.join(upload_folder, image_file))
+        except Exception as e:
+            return e
+        return None
 
-    # Delete unused images
+    # Delete unused images; unlinks are I/O bound, so run a few at a time
     deleted_count = 0
     deleted_files = []
-    for image_file in unused_images:
-        try:
-            file_path = os.path.join(upload_folder, image_file)
-            os.remove(file_path)
-            deleted_count += 1
-            deleted_files.append(image_file)
-        except Exception as e:
-            # Log error but continue with other files
-            current_app.logger.error(f"Error deleting {image_file}: {e}")
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        for image_file, error in zip(unused_images, pool.map(remove, unused_images)):
+            if error is None:
+                deleted_count += 1
+                deleted_files.append(image_file)
+            else:
+                # Log error but continue with other files
+                current_app.logger.error(f"Error deleting {image_file}: {error}")
 
     return deleted_count, deleted_files
@@ -50,10 +50,25 @@ class Config:
     IMAGE_QUALITY = 85  # WebP quality (1-100)
 
     # Rate limiting configuration
+    # In-memory counters are per process; with several Gunicorn workers point
+    # this at Redis (e.g. redis://localhost:6379/1) so limits are shared.
+    RATELIMIT_STORAGE_URI = os.getenv("RATELIMIT_STORAGE_URI", "memory://")
+    RATELIMIT_STRATEGY = os.getenv("RATELIMIT_STRATEGY", "moving-window")
     COMMENT_RATE_LIMIT = "10 per minute"
     LOGIN_RATE_LIMIT = "5 per minute"
 
+    # Feed cache (visible post IDs per user). Off by default; it has to be
+    # shared between workers, so enable it with Redis:
+    # CACHE_TYPE=RedisCache, CACHE_REDIS_URL=redis://localhost:6379/2
+    CACHE_TYPE = os.getenv("CACHE_TYPE", "NullCache")
+    CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL")
+    CACHE_DEFAULT_TIMEOUT = 300
+
     # Markdown rendering configuration
+    # HTML sanitizer: "nh3" (Rust, fast) or "bleach" (the previous pure-Python one).
+    # Posts and comments store their rendered HTML; after changing the sanitizer
+    # or the allowlists below, run "flask rerender-markdown" to refresh it
+    MARKDOWN_SANITIZER = os.getenv("MARKDOWN_SANITIZER", "nh3")
     MARKDOWN_ALLOWED_TAGS = [
         "a",
         "abbr",
@@ -0,0 +1,38 @@
+"""
+Gunicorn settings for running PicoBlog in production.
+
+Gunicorn picks this file up automatically when started from the project root:
+
+    gunicorn wsgi:app
+
+Every setting can be overridden with the matching GUNICORN_* environment
+variable or on the command line.
+"""
+
+import multiprocessing
+import os
+
+bind = os.getenv("GUNICORN_BIND", "127.0.0.1:8000")
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+
+# Threaded workers by default. The default SQLite driver, file I/O and argon2
+# password hashing are not made cooperative by gevent's monkey-patching, so
+# under gevent each of them would stall every request on the worker (and the
+# background image cleanup thread would become a blocking greenlet). gevent
+# only pays off with a network database driver it can make cooperative
+# (e.g. PyMySQL, or psycopg2 with psycogreen); opt in with
+# GUNICORN_WORKER_CLASS=gevent (pip install "picoblog[gevent]").
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+
+# CPU-heavy work (image encoding on upload, Markdown rendering when a post is
+# saved) holds the GIL while it runs. Threaded workers get two processes per
+# core so one busy process doesn't leave a core idle; Pillow and libvips
+# release the GIL while encoding.
+default_workers = multiprocessing.cpu_count() * (2 if worker_class == "gthread" else 1)
+workers = int(os.getenv("GUNICORN_WORKERS", default_workers))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "1000"))
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+
+# Worker heartbeat files go to tmpfs, so a slow disk can't stall workers
+if os.path.isdir("/dev/shm"):
+    worker_tmp_dir = os.getenv("GUNICORN_WORKER_TMP_DIR", "/dev/shm")
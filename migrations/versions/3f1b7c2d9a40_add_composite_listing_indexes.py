@@ -0,0 +1,41 @@
+"""Add composite indexes for post and comment listings
+
+Revision ID: 3f1b7c2d9a40
+Revises: 5ff44ef94951
+Create Date: 2026-10-15 12:00:00.000000
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "3f1b7c2d9a40"
+down_revision = "5ff44ef94951"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # ix_post_draft_ts starts with is_draft, so it replaces the single-column index
+    with op.batch_alter_table("post", schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f("ix_post_is_draft"))
+        batch_op.create_index(
+            "ix_post_draft_ts", ["is_draft", "timestamp"], unique=False
+        )
+
+    with op.batch_alter_table("comment", schema=None) as batch_op:
+        batch_op.create_index(
+            "ix_comment_post_ts", ["post_id", "timestamp"], unique=False
+        )
+
+
+def downgrade():
+    with op.batch_alter_table("comment", schema=None) as batch_op:
+        batch_op.drop_index("ix_comment_post_ts")
+
+    with op.batch_alter_table("post", schema=None) as batch_op:
+        batch_op.drop_index("ix_post_draft_ts")
+        batch_op.create_index(
+            batch_op.f("ix_post_is_draft"), ["is_draft"], unique=False
+        )
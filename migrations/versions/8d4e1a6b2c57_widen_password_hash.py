@@ -0,0 +1,37 @@
+"""Widen user.password_hash for argon2 and scrypt hashes
+
+Revision ID: 8d4e1a6b2c57
+Revises: 3f1b7c2d9a40
+Create Date: 2026-10-15 12:30:00.000000
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "8d4e1a6b2c57"
+down_revision = "3f1b7c2d9a40"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("user", schema=None) as batch_op:
+        batch_op.alter_column(
+            "password_hash",
+            existing_type=sa.String(length=128),
+            type_=sa.String(length=255),
+            existing_nullable=True,
+        )
+
+
+def downgrade():
+    with op.batch_alter_table("user", schema=None) as batch_op:
+        batch_op.alter_column(
+            "password_hash",
+            existing_type=sa.String(length=255),
+            type_=sa.String(length=128),
+            existing_nullable=True,
+        )
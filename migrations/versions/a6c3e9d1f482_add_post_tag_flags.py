@@ -0,0 +1,70 @@
+"""Add has_master_tags / has_regular_tags flags to post
+
+Revision ID: a6c3e9d1f482
+Revises: 8d4e1a6b2c57
+Create Date: 2026-10-15 13:10:00.000000
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "a6c3e9d1f482"
+down_revision = "8d4e1a6b2c57"
+branch_labels = None
+depends_on = None
+
+
+post = sa.table(
+    "post",
+    sa.column("id", sa.Integer),
+    sa.column("has_master_tags", sa.Boolean),
+    sa.column("has_regular_tags", sa.Boolean),
+)
+tag = sa.table("tag", sa.column("id", sa.Integer), sa.column("is_master", sa.Boolean))
+post_tags = sa.table(
+    "post_tags", sa.column("post_id", sa.Integer), sa.column("tag_id", sa.Integer)
+)
+
+
+def _has_tag(is_master):
+    return sa.exists().where(
+        post_tags.c.post_id == post.c.id,
+        post_tags.c.tag_id == tag.c.id,
+        tag.c.is_master.is_(is_master),
+    )
+
+
+def upgrade():
+    with op.batch_alter_table("post", schema=None) as batch_op:
+        batch_op.add_column(
+            sa.Column(
+                "has_master_tags",
+                sa.Boolean(),
+                server_default=sa.false(),
+                nullable=False,
+            )
+        )
+        batch_op.add_column(
+            sa.Column(
+                "has_regular_tags",
+                sa.Boolean(),
+                server_default=sa.false(),
+                nullable=False,
+            )
+        )
+
+    # Backfill from the existing tag assignments
+    op.execute(
+        post.update().values(
+            has_master_tags=_has_tag(True), has_regular_tags=_has_tag(False)
+        )
+    )
+
+
+def downgrade():
+    with op.batch_alter_table("post", schema=None) as batch_op:
+        batch_op.drop_column("has_regular_tags")
+        batch_op.drop_column("has_master_tags")
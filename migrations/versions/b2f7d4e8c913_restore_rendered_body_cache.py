@@ -0,0 +1,37 @@
+"""Restore rendered_body_cache on post and comment
+
+42e94ba164bb dropped the columns added in c9d2a7f3e5b1; the models map them
+again, so add them back. Existing rows start empty and are rendered on their
+next save.
+
+Revision ID: b2f7d4e8c913
+Revises: a6c3e9d1f482
+Create Date: 2026-10-15 18:20:00.000000
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "b2f7d4e8c913"
+down_revision = "a6c3e9d1f482"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("post", schema=None) as batch_op:
+        batch_op.add_column(sa.Column("rendered_body_cache", sa.Text(), nullable=True))
+
+    with op.batch_alter_table("comment", schema=None) as batch_op:
+        batch_op.add_column(sa.Column("rendered_body_cache", sa.Text(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table("comment", schema=None) as batch_op:
+        batch_op.drop_column("rendered_body_cache")
+
+    with op.batch_alter_table("post", schema=None) as batch_op:
+        batch_op.drop_column("rendered_body_cache")
@@ -1,17 +1,16 @@
 #!/usr/bin/env python3
 """
 Entry point for running the PicoBlog application in development mode.
-For production, use a WSGI server like Gunicorn or uWSGI.
+For production, use a WSGI server with wsgi.py (gunicorn wsgi:app).
 """
 
-from app import create_app
-
-app = create_app()
+from wsgi import app
 
 if __name__ == "__main__":
     # Run in development mode
     # Note: Set debug=False in production
     import os
 
+    print("DEV server - do NOT use in production (run: gunicorn wsgi:app)")
     debug_mode = os.getenv("FLASK_DEBUG", "True").lower() == "true"
     app.run(debug=debug_mode, host="127.0.0.1", port=5000)
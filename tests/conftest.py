@@ -0,0 +1,114 @@
+import pytest
+from argon2 import PasswordHasher
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from app import create_app, db
+from app.models import User
+from tests.helpers import TestConfig, enable_sqlite_savepoints
+
+
+@pytest.fixture(scope="session", autouse=True)
+def _fast_passwords():
+    """
+    Take password hashing out of the test run.
+
+    User passwords are stored and compared as plain text. Code that hashes
+    directly (the login view's dummy hash) gets the cheapest argon2
+    parameters instead of the production ~20 MiB, multi-pass ones.
+    """
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(User, "set_password", _set_plain_password)
+        mp.setattr(User, "check_password", _check_plain_password)
+        mp.setattr(
+            "app.models._password_hasher",
+            PasswordHasher(time_cost=1, memory_cost=8, parallelism=1),
+        )
+        yield
+
+
+@pytest.fixture
+def real_passwords(monkeypatch):
+    """Put the real User password methods back for one test."""
+    for name, method in _REAL_PASSWORD_METHODS.items():
+        monkeypatch.setattr(User, name, method)
+
+
+_REAL_PASSWORD_METHODS = {
+    "set_password": User.set_password,
+    "check_password": User.check_password,
+}
+
+
+def _set_plain_password(user, password):
+    user.password_hash = password
+
+
+def _check_plain_password(user, password):
+    return user.password_hash == password
+
+
+@pytest.fixture(scope="session")
+def app():
+    """
+    One app for the whole test session.
+
+    Blueprints, extensions and the Jinja environment are set up once per
+    process instead of once per test.
+    """
+    app = create_app(TestConfig)
+    # Compile the feed template up front so the first /rss test isn't the one
+    # that pays for it
+    app.jinja_env.get_template("rss.xml")
+    return app
+
+
+@pytest.fixture(scope="session")
+def _schema(app):
+    """Create the tables once for the whole session."""
+    with app.app_context():
+        enable_sqlite_savepoints(db.engine)
+        db.create_all()
+        yield
+        db.drop_all()
+
+
+@pytest.fixture
+def database(app, _schema):
+    """
+    Run the test inside a transaction that is rolled back afterwards.
+
+    The session joins the connection with a SAVEPOINT, so commits made by
+    the test or by the views it calls only release that savepoint.
+    """
+    with app.app_context():
+        connection = db.engine.connect()
+        transaction = connection.begin()
+        app_session = db.session
+        db.session = scoped_session(
+            sessionmaker(bind=connection, join_transaction_mode="create_savepoint")
+        )
+        try:
+            yield db
+        finally:
+            db.session.remove()
+            db.session = app_session
+            transaction.rollback()
+            connection.close()
+
+
+@pytest.fixture
+def client(app, database):
+    with app.test_client() as c:
+        yield c
+
+
+@pytest.fixture
+def login_as(client):
+    """Log a user in by writing the Flask-Login session keys directly."""
+
+    def _login_as(user):
+        with client.session_transaction() as session:
+            session["_user_id"] = str(user.id)
+            session["_fresh"] = True
+
+    return _login_as
@@ -0,0 +1,31 @@
+import factory
+from factory.alchemy import SQLAlchemyModelFactory
+
+from app import db
+from app.models import Post, User
+
+
+class BaseFactory(SQLAlchemyModelFactory):
+    class Meta:
+        abstract = True
+        # Looked up per call: the database fixture swaps db.session per test
+        sqlalchemy_session_factory = lambda: db.session  # noqa: E731
+        sqlalchemy_session_persistence = "flush"
+
+
+class UserFactory(BaseFactory):
+    class Meta:
+        model = User
+
+    username = factory.Sequence(lambda n: f"user{n}")
+    email = factory.LazyAttribute(lambda o: f"{o.username}@example.com")
+    password = factory.PostGenerationMethodCall("set_password", "password")
+
+
+class PostFactory(BaseFactory):
+    class Meta:
+        model = Post
+
+    title = factory.Sequence(lambda n: f"Post {n}")
+    body = "Body"
+    author = factory.SubFactory(UserFactory)
@@ -0,0 +1,36 @@
+from sqlalchemy import event
+
+from config import Config
+
+
+class TestConfig(Config):
+    TESTING = True
+    # Flask-SQLAlchemy serves in-memory SQLite through a single StaticPool
+    # connection, so the schema created by the _schema fixture lives for the
+    # whole session; each xdist worker process gets its own database
+    SQLALCHEMY_DATABASE_URI = "sqlite:///:memory:"
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ECHO = False
+    SECRET_KEY = "test_secret_key"
+    WTF_CSRF_ENABLED = False
+    PROPAGATE_EXCEPTIONS = True
+    # The app (and its in-memory rate limit counters) is shared by the whole
+    # session, so login attempts from different tests would add up
+    RATELIMIT_ENABLED = False
+
+
+def enable_sqlite_savepoints(engine):
+    """
+    Let pysqlite run SAVEPOINTs inside an outer transaction.
+
+    pysqlite manages BEGIN itself and breaks nested transactions, so hand
+    transaction control to SQLAlchemy (see the SQLAlchemy SQLite dialect docs).
+    """
+
+    @event.listens_for(engine, "connect")
+    def do_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def do_begin(conn):
+        conn.exec_driver_sql("BEGIN")
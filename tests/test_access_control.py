@@ -1,8 +1,11 @@
-import unittest
-from app import create_app, db
-from app.models import User, Post, Tag
+import time
+from types import SimpleNamespace
+from unittest import mock
+import pytest
+from app import cache, db
+from app.debug import count_queries
+from app.models import User, Post, Tag, post_tags, user_tags
 from app.services.access_control import get_posts_for_user, user_can_view_post
-from config import Config
 from flask_login import AnonymousUserMixin
 
 
@@ -22,221 +25,325 @@ class MockAnonymousUser(AnonymousUserMixin):
         return "<AnonymousUser>"
 
 
-class TestConfig(Config):
-    """Test-specific configuration."""
+@pytest.fixture
+def seeded(database):
+    """
+    Create the users, tags and posts every test starts from.
+
+    They are written inside the database fixture's transaction, so each
+    test gets a fresh copy and nothing outlives the test.
+    """
+    s = SimpleNamespace()
+
+    # --- Create Users ---
+    s.admin_user = User(username="admin", email="admin@example.com", is_admin=True)
+    s.admin_user.set_password("adminpass")
+
+    s.user_a = User(username="user_a", email="user_a@example.com", is_admin=False)
+    s.user_a.set_password("user_a_pass")
+
+    s.user_b = User(username="user_b", email="user_b@example.com", is_admin=False)
+    s.user_b.set_password("user_b_pass")
+
+    s.user_c = User(username="user_c", email="user_c@example.com", is_admin=False)
+    s.user_c.set_password("user_c_pass")
+
+    # --- Create Tags ---
+    s.tag_master = Tag(name="secret", is_master=True)  # This is the master tag
+    s.tag_regular = Tag(name="drawing", is_master=False)
+    s.tag_another_regular = Tag(name="tech", is_master=False)
+
+    # --- Assign Tags to Users ---
+    s.user_a.allowed_tags = [s.tag_regular, s.tag_another_regular]
+    s.user_b.allowed_tags = [s.tag_master]
+    s.user_c.allowed_tags = [s.tag_master, s.tag_regular]
+
+    # --- Create Posts ---
+    s.post_public = Post(title="Public Post", body="Content", author=s.admin_user)
+    s.post_regular = Post(
+        title="Regular Post",
+        body="Content",
+        author=s.admin_user,
+        tags=[s.tag_regular],
+    )
+    s.post_master_only = Post(
+        title="Master Only Post",
+        body="Content",
+        author=s.admin_user,
+        tags=[s.tag_master],
+    )
+    s.post_master_and_regular = Post(
+        title="Master and Regular Post",
+        body="Content",
+        author=s.admin_user,
+        tags=[s.tag_master, s.tag_regular],
+    )
+    s.post_draft = Post(
+        title="Draft Post", body="Content", author=s.admin_user, is_draft=True
+    )
+
+    # Tags go through the relationships rather than post_tags inserts so
+    # the post tag flags are filled in by the before_flush listener
+    db.session.add_all(
+        [
+            s.admin_user,
+            s.user_a,
+            s.user_b,
+            s.user_c,
+            s.post_public,
+            s.post_regular,
+            s.post_master_only,
+            s.post_master_and_regular,
+            s.post_draft,
+        ]
+    )
+    db.session.commit()
+    return s
+
+
+@pytest.fixture
+def simple_cache(app):
+    """Switch the shared app to an in-process cache for one test."""
+
+    def _init(**config):
+        cache.init_app(app, config={"CACHE_TYPE": "SimpleCache", **config})
+
+    yield _init
+    cache.init_app(app, config={"CACHE_TYPE": "NullCache"})
+
+
+def test_admin_sees_all(seeded):
+    """Admin should see all posts, including drafts."""
+    posts = get_posts_for_user(seeded.admin_user)
+    assert seeded.post_public in posts
+    assert seeded.post_regular in posts
+    assert seeded.post_master_only in posts
+    assert seeded.post_master_and_regular in posts
+    assert seeded.post_draft in posts
+
+
+def test_anonymous_user_sees_nothing(seeded):
+    """Anonymous user should see no posts."""
+    posts = get_posts_for_user(MockAnonymousUser())
+    assert len(posts) == 0
+
+
+def test_user_with_regular_tags_access(seeded):
+    """Test access for a user with only regular tags."""
+    posts = get_posts_for_user(seeded.user_a)
+
+    assert seeded.post_public in posts, "User should see public posts"
+    assert seeded.post_regular in posts, "User should see post with their regular tag"
+    assert (
+        seeded.post_master_only not in posts
+    ), "User should NOT see post with only a master tag"
+    assert (
+        seeded.post_master_and_regular not in posts
+    ), "User should NOT see post with a master tag, even if they have a regular tag on it"
+    assert seeded.post_draft not in posts, "User should NOT see draft posts"
+
+
+def test_user_with_master_tag_access(seeded):
+    """Test access for a user with a master tag."""
+    posts = get_posts_for_user(seeded.user_b)
+
+    assert seeded.post_public in posts, "User should see public posts"
+    assert (
+        seeded.post_regular not in posts
+    ), "User should NOT see post with a regular tag they don't have"
+    assert (
+        seeded.post_master_only in posts
+    ), "User should see post with a master tag they have"
+    assert (
+        seeded.post_master_and_regular not in posts
+    ), "User should NOT see post with both master and regular tags if they only have the master tag"
+    assert seeded.post_draft not in posts, "User should NOT see draft posts"
+
+
+def test_user_with_master_and_regular_tag_access(seeded):
+    """Test access for a user with both master and regular tags."""
+    posts = get_posts_for_user(seeded.user_c)
+
+    assert seeded.post_public in posts, "User should see public posts"
+    assert (
+        seeded.post_master_and_regular in posts
+    ), "User should see post with master and regular tags they have"
+    assert (
+        seeded.post_master_only in posts
+    ), "User should see post with only a master tag"
+    assert (
+        seeded.post_regular in posts
+    ), "User should see post with a regular tag they have"
+
+
+def test_individual_post_view_logic(seeded):
+    """Test the user_can_view_post function directly."""
+    s = seeded
+    anon_user = MockAnonymousUser()
+
+    # Admin can view all
+    assert user_can_view_post(s.admin_user, s.post_draft)
+    assert user_can_view_post(s.admin_user, s.post_master_and_regular)
+
+    # User A (regular tags only)
+    assert user_can_view_post(s.user_a, s.post_public)
+    assert user_can_view_post(s.user_a, s.post_regular)
+    assert not user_can_view_post(s.user_a, s.post_master_only)
+    assert not user_can_view_post(s.user_a, s.post_master_and_regular)
+
+    # User B (master tag)
+    assert user_can_view_post(s.user_b, s.post_public)
+    assert not user_can_view_post(s.user_b, s.post_regular)
+    assert user_can_view_post(s.user_b, s.post_master_only)
+    assert not user_can_view_post(s.user_b, s.post_master_and_regular)
+
+    # User C (master and regular tag)
+    assert user_can_view_post(s.user_c, s.post_public)
+    assert user_can_view_post(s.user_c, s.post_regular)
+    assert user_can_view_post(s.user_c, s.post_master_only)
+    assert user_can_view_post(s.user_c, s.post_master_and_regular)
+
+    # Anonymous user
+    assert not user_can_view_post(anon_user, s.post_public)
+    assert not user_can_view_post(anon_user, s.post_master_and_regular)
+
+
+def test_sql_filter_matches_user_can_view_post(app, seeded, monkeypatch):
+    """The SQL visibility filter should agree with the per-post check."""
+    user_d = User(username="user_d", email="user_d@example.com")
+    user_d.set_password("user_d_pass")
+    db.session.add(user_d)
+    db.session.commit()
+
+    all_posts = Post.query.all()
+    users = [seeded.admin_user, seeded.user_a, seeded.user_b, seeded.user_c, user_d]
+    for require_login in (True, False):
+        monkeypatch.setitem(app.config, "REQUIRE_LOGIN", require_login)
+        for user in users + [MockAnonymousUser()]:
+            expected = {p.id for p in all_posts if user_can_view_post(user, p)}
+            actual = {p.id for p in get_posts_for_user(user)}
+            assert actual == expected, f"{user} (REQUIRE_LOGIN={require_login})"
+
+
+def test_post_tag_flags_follow_tag_changes(seeded):
+    """has_master_tags / has_regular_tags should track the post's tags."""
+    s = seeded
+    post = s.post_master_and_regular
+    assert post.has_master_tags
+    assert post.has_regular_tags
+
+    post.tags.remove(s.tag_regular)
+    db.session.commit()
+    assert post.has_master_tags
+    assert not post.has_regular_tags
+
+    s.tag_master.is_master = False
+    db.session.commit()
+    assert not s.post_master_only.has_master_tags
+    assert s.post_master_only.has_regular_tags
+
+    db.session.delete(s.tag_master)
+    db.session.commit()
+    assert s.post_master_only.is_public()
+    assert s.post_regular.has_regular_tags
+
+
+def test_feed_cache_follows_post_changes(seeded, simple_cache):
+    """Cached feeds should match fresh ones and expire on post/tag commits."""
+    simple_cache()
+
+    fresh = get_posts_for_user(seeded.user_a)
+    assert get_posts_for_user(seeded.user_a) == fresh
+    assert seeded.post_master_only not in fresh
+
+    seeded.post_master_only.tags.remove(seeded.tag_master)
+    db.session.commit()
+    assert seeded.post_master_only in get_posts_for_user(seeded.user_a)
+
+
+def test_feed_cache_generation_never_expires(seeded, simple_cache, monkeypatch):
+    """Expiring the generation counter would bring back stale feeds."""
+    simple_cache(CACHE_DEFAULT_TIMEOUT=1)
+
+    seeded.post_master_only.tags.remove(seeded.tag_master)
+    db.session.commit()
+    seeded.post_master_only.tags.append(seeded.tag_master)
+    db.session.commit()
+
+    # Long after the default timeout the counter is still there
+    later = time.time() + 3600
+    monkeypatch.setattr("cachelib.simple.time", lambda: later)
+    assert cache.get("vis:generation") == 2
+
+
+def test_feed_cache_outage_is_not_an_error(seeded, simple_cache, monkeypatch):
+    """A failing cache backend should neither fail commits nor feeds."""
+    simple_cache()
+    outage = ConnectionError("cache is down")
+    for name in ("get", "set", "add"):
+        monkeypatch.setattr(cache.cache, name, mock.Mock(side_effect=outage))
+
+    seeded.post_master_only.tags.remove(seeded.tag_master)
+    db.session.commit()
+    assert seeded.post_master_only in get_posts_for_user(seeded.user_a)
+
+
+def test_tag_id_set_tracks_allowed_tags(seeded):
+    """The cached tag id set should follow changes to allowed_tags."""
+    s = seeded
+    assert s.user_b.tag_id_set == {s.tag_master.id}
+
+    s.user_b.allowed_tags.append(s.tag_regular)
+    assert s.user_b.tag_id_set == {s.tag_master.id, s.tag_regular.id}
+
+    s.user_b.allowed_tags.remove(s.tag_master)
+    assert s.user_b.tag_id_set == {s.tag_regular.id}
 
-    TESTING = True
-    SQLALCHEMY_DATABASE_URI = "sqlite:///:memory:"
-    SQLALCHEMY_TRACK_MODIFICATIONS = False
-    SECRET_KEY = "test_secret_key"
-    WTF_CSRF_ENABLED = False
 
+def test_tag_id_set_reloads_after_expire(seeded):
+    """Expiring the user (directly or by commit) should drop the cached tag ids."""
+    s = seeded
+    assert s.user_b.tag_id_set == {s.tag_master.id}
 
-class AccessControlTestCase(unittest.TestCase):
-    """Test suite for access control logic based on tag `is_master` field."""
-
-    def setUp(self):
-        """Set up the test environment."""
-        self.app = create_app(TestConfig)
-        self.app_context = self.app.app_context()
-        self.app_context.push()
-        db.create_all()
-
-        # --- Create Users ---
-        self.admin_user = User(
-            username="admin", email="admin@example.com", is_admin=True
-        )
-        self.admin_user.set_password("adminpass")
-
-        self.user_a = User(
-            username="user_a", email="user_a@example.com", is_admin=False
-        )
-        self.user_a.set_password("user_a_pass")
-
-        self.user_b = User(
-            username="user_b", email="user_b@example.com", is_admin=False
-        )
-        self.user_b.set_password("user_b_pass")
-
-        self.user_c = User(
-            username="user_c", email="user_c@example.com", is_admin=False
-        )
-        self.user_c.set_password("user_c_pass")
-
-        db.session.add_all([self.admin_user, self.user_a, self.user_b, self.user_c])
-        db.session.commit()
-
-        # --- Create Tags ---
-        self.tag_master = Tag(name="secret", is_master=True)  # This is the master tag
-        self.tag_regular = Tag(name="drawing", is_master=False)
-        self.tag_another_regular = Tag(name="tech", is_master=False)
-
-        db.session.add_all(
-            [self.tag_master, self.tag_regular, self.tag_another_regular]
-        )
-        db.session.commit()
-
-        # --- Assign Tags to Users ---
-        self.user_a.allowed_tags.append(self.tag_regular)
-        self.user_a.allowed_tags.append(self.tag_another_regular)
-
-        self.user_b.allowed_tags.append(self.tag_master)
-
-        self.user_c.allowed_tags.append(self.tag_master)
-        self.user_c.allowed_tags.append(self.tag_regular)
-
-        db.session.commit()
-
-        # --- Create Posts ---
-        self.post_public = Post(
-            title="Public Post", body="Content", author=self.admin_user
-        )
-        self.post_regular = Post(
-            title="Regular Post", body="Content", author=self.admin_user
-        )
-        self.post_master_only = Post(
-            title="Master Only Post", body="Content", author=self.admin_user
-        )
-        self.post_master_and_regular = Post(
-            title="Master and Regular Post", body="Content", author=self.admin_user
-        )
-        self.post_draft = Post(
-            title="Draft Post", body="Content", author=self.admin_user, is_draft=True
-        )
-
-        db.session.add_all(
-            [
-                self.post_public,
-                self.post_regular,
-                self.post_master_only,
-                self.post_master_and_regular,
-                self.post_draft,
-            ]
-        )
-        db.session.commit()
-
-        # --- Assign Tags to Posts ---
-        self.post_regular.tags.append(self.tag_regular)
-        self.post_master_only.tags.append(self.tag_master)
-        self.post_master_and_regular.tags.append(self.tag_master)
-        self.post_master_and_regular.tags.append(self.tag_regular)
-
-        db.session.commit()
-
-    def tearDown(self):
-        """Tear down the test environment."""
-        db.session.remove()
-        db.drop_all()
-        self.app_context.pop()
-
-    def test_admin_sees_all(self):
-        """Admin should see all posts, including drafts."""
-        posts = get_posts_for_user(self.admin_user)
-        self.assertIn(self.post_public, posts)
-        self.assertIn(self.post_regular, posts)
-        self.assertIn(self.post_master_only, posts)
-        self.assertIn(self.post_master_and_regular, posts)
-        self.assertIn(self.post_draft, posts)
-
-    def test_anonymous_user_sees_nothing(self):
-        """Anonymous user should see no posts."""
-        anon_user = MockAnonymousUser()
-        posts = get_posts_for_user(anon_user)
-        self.assertEqual(len(posts), 0)
-
-    def test_user_with_regular_tags_access(self):
-        """Test access for a user with only regular tags."""
-        posts = get_posts_for_user(self.user_a)
-
-        self.assertIn(self.post_public, posts, "User should see public posts")
-        self.assertIn(
-            self.post_regular, posts, "User should see post with their regular tag"
-        )
-        self.assertNotIn(
-            self.post_master_only,
-            posts,
-            "User should NOT see post with only a master tag",
-        )
-        self.assertNotIn(
-            self.post_master_and_regular,
-            posts,
-            "User should NOT see post with a master tag, even if they have a regular tag on it",
-        )
-        self.assertNotIn(self.post_draft, posts, "User should NOT see draft posts")
-
-    def test_user_with_master_tag_access(self):
-        """Test access for a user with a master tag."""
-        posts = get_posts_for_user(self.user_b)
-
-        self.assertIn(self.post_public, posts, "User should see public posts")
-        self.assertNotIn(
-            self.post_regular,
-            posts,
-            "User should NOT see post with a regular tag they don't have",
-        )
-        self.assertIn(
-            self.post_master_only,
-            posts,
-            "User should see post with a master tag they have",
-        )
-        self.assertNotIn(
-            self.post_master_and_regular,
-            posts,
-            "User should NOT see post with both master and regular tags if they only have the master tag",
-        )
-        self.assertNotIn(self.post_draft, posts, "User should NOT see draft posts")
-
-    def test_user_with_master_and_regular_tag_access(self):
-        """Test access for a user with both master and regular tags."""
-        posts = get_posts_for_user(self.user_c)
-
-        self.assertIn(self.post_public, posts, "User should see public posts")
-        self.assertIn(
-            self.post_master_and_regular,
-            posts,
-            "User should see post with master and regular tags they have",
+    db.session.execute(
+        user_tags.insert().values(user_id=s.user_b.id, tag_id=s.tag_regular.id)
+    )
+    db.session.expire(s.user_b)
+    assert s.user_b.tag_id_set == {s.tag_master.id, s.tag_regular.id}
+
+    db.session.execute(
+        user_tags.delete().where(
+            user_tags.c.user_id == s.user_b.id, user_tags.c.tag_id == s.tag_master.id
         )
-        self.assertIn(
-            self.post_master_only, posts, "User should see post with only a master tag"
-        )
-        self.assertIn(
-            self.post_regular,
-            posts,
-            "User should see post with a regular tag they have",
-        )
-
-    def test_individual_post_view_logic(self):
-        """Test the user_can_view_post function directly."""
-        anon_user = MockAnonymousUser()
-
-        # Admin can view all
-        self.assertTrue(user_can_view_post(self.admin_user, self.post_draft))
-        self.assertTrue(
-            user_can_view_post(self.admin_user, self.post_master_and_regular)
-        )
-
-        # User A (regular tags only)
-        self.assertTrue(user_can_view_post(self.user_a, self.post_public))
-        self.assertTrue(user_can_view_post(self.user_a, self.post_regular))
-        self.assertFalse(user_can_view_post(self.user_a, self.post_master_only))
-        self.assertFalse(user_can_view_post(self.user_a, self.post_master_and_regular))
-
-        # User B (master tag)
-        self.assertTrue(user_can_view_post(self.user_b, self.post_public))
-        self.assertFalse(user_can_view_post(self.user_b, self.post_regular))
-        self.assertTrue(user_can_view_post(self.user_b, self.post_master_only))
-        self.assertFalse(user_can_view_post(self.user_b, self.post_master_and_regular))
-
-        # User C (master and regular tag)
-        self.assertTrue(user_can_view_post(self.user_c, self.post_public))
-        self.assertTrue(user_can_view_post(self.user_c, self.post_regular))
-        self.assertTrue(user_can_view_post(self.user_c, self.post_master_only))
-        self.assertTrue(user_can_view_post(self.user_c, self.post_master_and_regular))
-
-        # Anonymous user
-        self.assertFalse(user_can_view_post(anon_user, self.post_public))
-        self.assertFalse(user_can_view_post(anon_user, self.post_master_and_regular))
-
-
-if __name__ == "__main__":
-    unittest.main()
+    )
+    db.session.commit()
+    assert s.user_b.tag_id_set == {s.tag_regular.id}
+
+
+def test_tag_id_partition_follows_master_flag(seeded):
+    """Flipping a loaded tag's is_master should repartition its posts."""
+    s = seeded
+    post = s.post_master_only
+    assert post.tag_id_partition == ({s.tag_master.id}, set())
+
+    s.tag_master.is_master = False
+    db.session.flush()
+    assert post.tag_id_partition == (set(), {s.tag_master.id})
+
+    db.session.execute(
+        post_tags.insert().values(post_id=post.id, tag_id=s.tag_regular.id)
+    )
+    db.session.expire(post)
+    assert post.tag_id_partition == (set(), {s.tag_master.id, s.tag_regular.id})
+
+
+def test_feed_query_count_is_constant(seeded):
+    """Building a feed should not issue a query per post."""
+    for user in (seeded.admin_user, seeded.user_c):
+        db.session.expire_all()
+        with count_queries() as queries:
+            posts = get_posts_for_user(user)
+            for post in posts:
+                post.author.username
+                list(post.tags)
+        assert queries.count <= 4
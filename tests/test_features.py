@@ -1,103 +1,262 @@
-import unittest
+import io
+import os
+import re
+import tempfile
+import pytest
+from PIL import Image
+from werkzeug.security import generate_password_hash
 from app import create_app, db
-from app.models import User, Post, Tag
-from config import Config
-
-class TestConfig(Config):
-    TESTING = True
-    SQLALCHEMY_DATABASE_URI = "sqlite:///:memory:"
-    SQLALCHEMY_TRACK_MODIFICATIONS = False
-    SECRET_KEY = "test_secret_key"
-    WTF_CSRF_ENABLED = False
-
-class RSSAndThemeTestCase(unittest.TestCase):
-    def setUp(self):
-        self.app = create_app(TestConfig)
-        self.app_context = self.app.app_context()
-        self.app_context.push()
-        self.client = self.app.test_client()
-        db.create_all()
-
-    def tearDown(self):
-        db.session.remove()
-        db.drop_all()
-        self.app_context.pop()
-
-    def test_rss_feed_anonymous(self):
-        # Anonymous users should be redirected to login
-        response = self.client.get("/rss")
-        self.assertEqual(response.status_code, 302)
-        self.assertIn("/login", response.location)
-
-    def test_rss_feed_authorized(self):
-        # Create user and log in
-        user = User(username="testuser", email="test@example.com")
-        user.set_password("password")
-        db.session.add(user)
-        db.session.commit()
-        
-        # Log in
-        self.client.post("/login", data=dict(username="testuser", password="password"), follow_redirects=True)
-        
-        response = self.client.get("/rss")
-        self.assertEqual(response.status_code, 200)
-        self.assertEqual(response.content_type, "application/rss+xml")
-        self.assertIn(b"<title>PicoBlog</title>", response.data)
-
-    def test_rss_feed_with_posts(self):
-        # Create a public post
-        admin = User(username="admin", email="admin@example.com")
-        admin.set_password("adminpass")
-        db.session.add(admin)
-        post = Post(title="Public Title", body="Public Body", author=admin)
-        db.session.add(post)
-        db.session.commit()
-
-        # Log in as admin
-        self.client.post("/login", data=dict(username="admin", password="adminpass"), follow_redirects=True)
-
-        response = self.client.get("/rss")
-        self.assertEqual(response.status_code, 200)
-        self.assertIn(b"Public Title", response.data)
-        self.assertIn(b"Public Body", response.data)
-
-    def test_rss_feed_with_tagged_posts(self):
-        # Create user and tag
-        user = User(username="user_t", email="user_t@example.com")
-        user.set_password("password")
-        tag = Tag(name="secret")
-        db.session.add_all([user, tag])
-        user.allowed_tags.append(tag)
-        
-        # Create tagged post
-        admin = User(username="admin_s", email="admin_s@example.com")
-        admin.set_password("adminpass")
-        db.session.add(admin)
-        post = Post(title="Secret Title", body="Secret Body", author=admin)
-        post.tags.append(tag)
-        db.session.add(post)
-        db.session.commit()
-
-        # Log in as user
-        self.client.post("/login", data=dict(username="user_t", password="password"), follow_redirects=True)
-
-        response = self.client.get("/rss")
-        self.assertEqual(response.status_code, 200)
-        self.assertIn(b"Secret Title", response.data)
-        self.assertIn(b"Secret Body", response.data)
-
-    def test_theme_toggle(self):
-        # Initial theme toggle (light -> dark)
-        response = self.client.get("/toggle-theme", follow_redirects=False)
-        self.assertEqual(response.status_code, 302)
-        # Check if cookie is set
-        self.assertIn("theme=dark", response.headers.get("Set-Cookie"))
-
-        # Toggle again (dark -> light)
-        self.client.set_cookie("theme", "dark")
-        response = self.client.get("/toggle-theme", follow_redirects=False)
-        self.assertEqual(response.status_code, 302)
-        self.assertIn("theme=light", response.headers.get("Set-Cookie"))
-
-if __name__ == "__main__":
-    unittest.main()
+from app.models import Post, Tag, User, hash_password, verify_password
+from app.utils import (
+    _save_webp_pillow,
+    _save_webp_vips,
+    cleanup_unused_images,
+    pyvips,
+    render_markdown,
+)
+from tests.factories import PostFactory, UserFactory
+from tests.helpers import TestConfig
+
+# Title and body of a feed item, checked in one pass over the XML
+_PUBLIC_ITEM_RE = re.compile(rb"<title>Public Title</title>.*?Public Body", re.S)
+_SECRET_ITEM_RE = re.compile(rb"<title>Secret Title</title>.*?Secret Body", re.S)
+
+
+def test_rss_feed_anonymous(client):
+    # Feed readers can't follow a login redirect, so anonymous users get a 401
+    response = client.get("/rss")
+    assert response.status_code == 401
+
+
+def test_rss_feed_authorized(client, login_as):
+    login_as(UserFactory())
+
+    response = client.get("/rss")
+    assert response.status_code == 200
+    assert response.content_type == "application/rss+xml"
+    assert b"<title>PicoBlog</title>" in response.data
+
+
+def test_rss_feed_with_posts(client, login_as):
+    # Create a public post and log in as its author
+    post = PostFactory(title="Public Title", body="Public Body")
+    login_as(post.author)
+
+    response = client.get("/rss")
+    assert response.status_code == 200
+    assert _PUBLIC_ITEM_RE.search(response.data)
+
+
+def test_rss_feed_with_tagged_posts(client, login_as):
+    # A user allowed to see the post's tag
+    tag = Tag(name="secret")
+    user = UserFactory(allowed_tags=[tag])
+    PostFactory(title="Secret Title", body="Secret Body", tags=[tag])
+
+    login_as(user)
+
+    response = client.get("/rss")
+    assert response.status_code == 200
+    assert _SECRET_ITEM_RE.search(response.data)
+
+
+@pytest.mark.parametrize("initial,expected", [(None, "dark"), ("dark", "light")])
+def test_theme_toggle(client, initial, expected):
+    # No cookie means light, so the first toggle goes to dark and back again
+    if initial:
+        client.set_cookie("theme", initial)
+    response = client.get("/toggle-theme", follow_redirects=False)
+    assert response.status_code == 302
+    assert f"theme={expected}" in response.headers.get("Set-Cookie")
+
+
+def test_htmx_delete_post(client, login_as):
+    post = PostFactory(author__is_admin=True)
+    post_id = post.id
+
+    login_as(post.author)
+
+    # htmx gets an empty 200 to swap the card out instead of a redirect
+    response = client.post(f"/admin/admin/posts/{post_id}/delete", headers={"HX-Request": "true"})
+    assert response.status_code == 200
+    assert response.data == b""
+    assert db.session.get(Post, post_id) is None
+
+
+def test_rendered_body_cached_on_save(database):
+    post = PostFactory(body="**bold**")
+    assert "<strong>bold</strong>" in post.rendered_body_cache
+
+    # Editing the body re-renders on the next save
+    post.body = "*italic*"
+    assert post.rendered_body_cache is None
+    db.session.flush()
+    assert "<em>italic</em>" in post.rendered_body
+
+
+def test_cleanup_images_command(app, database, monkeypatch):
+    PostFactory(body="![pic](/static/uploads/kept.webp)")
+
+    with tempfile.TemporaryDirectory() as upload_folder:
+        monkeypatch.setitem(app.config, "UPLOAD_FOLDER", upload_folder)
+        for name in ("kept.webp", "unused.webp"):
+            open(os.path.join(upload_folder, name), "wb").close()
+
+        result = app.test_cli_runner().invoke(args=["cleanup-images"])
+        assert "Deleted 1 unused image(s)." in result.output
+        assert os.listdir(upload_folder) == ["kept.webp"]
+
+
+_WEBP_SAVERS = [_save_webp_pillow] + ([_save_webp_vips] if pyvips is not None else [])
+
+
+@pytest.mark.parametrize("save", _WEBP_SAVERS)
+@pytest.mark.parametrize("size,expected", [((800, 3000), (800, 3000)), ((1600, 3000), (1200, 2250))])
+def test_webp_resize_caps_width_only(tmp_path, save, size, expected):
+    # Tall images are only limited by IMAGE_MAX_WIDTH, whichever encoder runs
+    buffer = io.BytesIO()
+    Image.new("RGB", size, "white").save(buffer, "PNG")
+
+    path = tmp_path / "out.webp"
+    save(buffer.getvalue(), str(path), 1200, 85)
+    with Image.open(path) as img:
+        assert img.size == expected
+
+
+@pytest.mark.parametrize("save", _WEBP_SAVERS)
+def test_webp_drops_exif_and_applies_orientation(tmp_path, save):
+    # A camera photo stored sideways: orientation 6 means rotate 90 degrees
+    exif = Image.Exif()
+    exif[0x010F] = "Camera Maker"  # Make
+    exif[0x0112] = 6  # Orientation
+    buffer = io.BytesIO()
+    Image.new("RGB", (100, 50), "white").save(buffer, "JPEG", exif=exif)
+
+    path = tmp_path / "out.webp"
+    save(buffer.getvalue(), str(path), 1200, 85)
+    with Image.open(path) as img:
+        assert "exif" not in img.info
+        assert img.size == (50, 100)
+
+
+def test_author_views_own_tagged_post(client, login_as):
+    # The post's author is also the logged-in viewer; strict loading on the
+    # post query must not break the viewer's tag check
+    tag = Tag(name="drawing")
+    user = UserFactory(allowed_tags=[tag])
+    post = PostFactory(title="My Drawing", author=user, tags=[tag])
+    login_as(user)
+    post_id = post.id
+
+    # Start the request with an empty session, like a fresh request would
+    db.session.expunge_all()
+    response = client.get(f"/post/{post_id}")
+    assert response.status_code == 200
+    assert b"My Drawing" in response.data
+
+
+def test_cleanup_keeps_every_referenced_name(app, database, monkeypatch):
+    PostFactory(body="![a](/static/uploads/a+b.png) ![b](/static/uploads/my%20pic.png)")
+    PostFactory(body="Old image: legacy.gif")
+
+    with tempfile.TemporaryDirectory() as upload_folder:
+        monkeypatch.setitem(app.config, "UPLOAD_FOLDER", upload_folder)
+        for name in ("a+b.png", "my pic.png", "legacy.gif", "unused.png"):
+            open(os.path.join(upload_folder, name), "wb").close()
+
+        deleted_count, deleted_files = cleanup_unused_images()
+        assert deleted_files == ["unused.png"]
+        assert sorted(os.listdir(upload_folder)) == ["a+b.png", "legacy.gif", "my pic.png"]
+
+
+def test_login_upgrades_legacy_hash(client, real_passwords):
+    # Users created before the switch to argon2 still have Werkzeug hashes
+    user = UserFactory()
+    user.password_hash = generate_password_hash("secret", method="pbkdf2:sha256:1000")
+    db.session.commit()
+    user_id = user.id
+
+    response = client.post("/login", data=dict(username=user.username, password="secret"))
+    assert response.status_code == 302
+    assert "/login" not in response.location
+
+    # The password was rehashed with argon2 while it was at hand
+    user = db.session.get(User, user_id)
+    assert user.password_hash.startswith("$argon2")
+    assert user.check_password("secret")
+    assert not user.password_needs_rehash()
+
+
+def test_login_rejects_wrong_password(client, real_passwords):
+    user = UserFactory()
+    user.password_hash = generate_password_hash("secret", method="pbkdf2:sha256:1000")
+    db.session.commit()
+    user_id = user.id
+
+    response = client.post("/login", data=dict(username=user.username, password="wrong"))
+    assert response.location.endswith("/login")
+    # No rehash without a correct password
+    assert db.session.get(User, user_id).password_hash.startswith("pbkdf2:")
+
+
+def test_verify_password():
+    argon2_hash = hash_password("secret")
+    werkzeug_hash = generate_password_hash("secret", method="pbkdf2:sha256:1000")
+
+    assert verify_password(argon2_hash, "secret")
+    assert verify_password(werkzeug_hash, "secret")
+    assert not verify_password(argon2_hash, "wrong")
+    assert not verify_password(werkzeug_hash, "wrong")
+    assert not verify_password("$argon2id$garbage", "secret")
+    assert not verify_password(None, "secret")
+
+
+def test_render_cache_is_keyed_by_sanitizer_policy(app, monkeypatch):
+    # Same text, different allowlists or sanitizer: never a shared cache entry
+    class NoStrongConfig(TestConfig):
+        MARKDOWN_ALLOWED_TAGS = [
+            tag for tag in TestConfig.MARKDOWN_ALLOWED_TAGS if tag != "strong"
+        ]
+
+    with app.app_context():
+        assert "<strong>bold</strong>" in render_markdown("**bold**")
+    with create_app(NoStrongConfig).app_context():
+        assert "<strong>" not in render_markdown("**bold**")
+
+    with app.app_context():
+        assert "alert(1)" not in render_markdown("<script>alert(1)</script>")
+        monkeypatch.setitem(app.config, "MARKDOWN_SANITIZER", "bleach")
+        assert "alert(1)" in render_markdown("<script>alert(1)</script>")
+
+
+def test_rerender_markdown_command(app, database, monkeypatch):
+    post = PostFactory(body="**bold** <sup>up</sup>")
+    post_id = post.id
+    assert "<sup>" in post.rendered_body_cache
+
+    # Tighten the allowlist; the stored HTML stays as it was until re-rendered
+    tags = [tag for tag in app.config["MARKDOWN_ALLOWED_TAGS"] if tag != "sup"]
+    monkeypatch.setitem(app.config, "MARKDOWN_ALLOWED_TAGS", tags)
+    monkeypatch.delitem(app.extensions, "nh3_allowlists", raising=False)
+    monkeypatch.delitem(app.extensions, "markdown_allowlist_digest", raising=False)
+
+    result = app.test_cli_runner().invoke(args=["rerender-markdown"])
+    assert "Re-rendered 1 post(s) and comment(s)." in result.output
+    db.session.expire_all()
+    html = db.session.get(Post, post_id).rendered_body_cache
+    assert "<strong>bold</strong>" in html
+    assert "<sup>" not in html
+
+
+def test_memory_rate_limit_storage_warns_outside_testing(caplog):
+    # Each Gunicorn worker would keep its own in-memory counters
+    class ProductionConfig(TestConfig):
+        TESTING = False
+        RATELIMIT_ENABLED = True
+
+    create_app(ProductionConfig)
+    assert "RATELIMIT_STORAGE_URI is memory://" in caplog.text
+
+    caplog.clear()
+    create_app(TestConfig)
+    assert "RATELIMIT_STORAGE_URI" not in caplog.text
@@ -0,0 +1,12 @@
+"""
+WSGI entry point for production servers.
+
+    gunicorn wsgi:app
+
+Gunicorn reads its worker settings from gunicorn.conf.py. Use run.py only
+for local development.
+"""
+
+from app import create_app
+
+app = create_app()